@@ -1,45 +1,91 @@
+import threading
 import streamlit as st
 import pandas as pd
-from processing import parallel_city_statistics, get_response, is_anomaly
+from ingestion import load_temperature_files
+from plot_data import downsample_city_series
+from processing import (anomaly_labels, build_aggregation_cube, build_season_index, compute_city_statistics,
+                        cube_box, cube_describe, cube_month_histogram, cube_years, is_anomaly, is_anomaly_batch,
+                        iter_city_statistics, season_statistics)
+from profiling import ProfileRun, current_run, timed_stage
+from result_cache import cached_city_statistics, content_hash
+from weather_client import get_responses
 import plotly.express as px
-
-@st.cache_data
-def load_data(file):
-    df = pd.read_csv(file)
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    return df
+import plotly.graph_objects as go
+
+# Окно скользящих статистик — 30 дней по времени, а не 30 строк: так же работают почасовые ряды и ряды с пропусками
+WINDOW = "30D"
+
+# Типизированная загрузка чанками: города и сезоны — категории, температура — float32,
+# плюс индекс смещений строк каждого города. Несколько выгрузок читаются параллельно пулом потоков.
+# Датафрейм держится в памяти процесса по хэшу файлов, без копирования на каждый перезапуск скрипта
+@timed_stage()
+@st.cache_resource(max_entries=2)
+def load_data(dataset_key, _files):
+    return load_temperature_files(_files)
+
+# Ленивые статистики: после загрузки ничего не считается, каждый раздел запрашивает только то,
+# что нужно ему для выбранного города. Результаты запоминаются по (хэш датасета, город, окно),
+# строки города берутся срезом по индексу смещений
+def city_rows(data, city_offsets, city):
+    city_start, city_end = city_offsets[city]
+    return data.iloc[city_start:city_end]
+
+# Наблюдения города со скользящими статистиками, аномалиями и трендом + профили (раздел 5).
+# Кроме памяти процесса лежат в дисковом кэше и переживают перезапуск приложения
+@timed_stage()
+@st.cache_data(max_entries=32)
+def load_city_statistics(dataset_key, city, window, _data, _city_offsets):
+    city_data = city_rows(_data, _city_offsets, city).copy()
+    return cached_city_statistics(f"{dataset_key}:{city}", city_data, compute_city_statistics, window_days=window)
+
+# Профиль сезонов города: только средние и std, без скользящих (разделы 2 и 3)
+@timed_stage()
+@st.cache_data(max_entries=256)
+def load_season_profile(dataset_key, city, _data, _city_offsets):
+    return season_statistics(city_rows(_data, _city_offsets, city))
+
+# (город, сезон) -> (среднее, std) по всем городам — только для таблицы текущей погоды во всех городах
+@timed_stage()
+@st.cache_data(max_entries=2)
+def load_season_index(dataset_key, _data):
+    return build_season_index(season_statistics(_data))
+
+# Куб предагрегатов города для таблиц и гистограмм разделов 4–5
+@timed_stage()
+@st.cache_resource(max_entries=32)
+def load_city_cube(dataset_key, city, _data, _city_offsets):
+    return build_aggregation_cube(city_rows(_data, _city_offsets, city))
+
+# Замер одного запуска скрипта: этапы загрузчиков выше (с попаданиями в кэш) и расчетов внутри них,
+# сводка — в разделе «Производительность» в конце страницы. Запуск, прерванный перезапуском скрипта
+# (кнопкой или виджетом), до stop() не доходит — сбрасываем его замер, иначе stop() нового вернет старый
+current_run.set(None)
+profile_run = ProfileRun().start()
 
 st.title("Аналитика температуры воздуха в городах")
 st.header("1. Загрузка данных")
 
-uploaded_file = st.file_uploader("Выберите CSV-файл", type=["csv"])
+uploaded_files = st.file_uploader("Выберите CSV- или Parquet-файлы выгрузок", type=["csv", "parquet"],
+                                  accept_multiple_files=True)
+# None, пока ничего не загружено
+uploaded_file = uploaded_files or None
 
-# Загрузка файла
+# Загрузка файлов: до первого вывода только разбор файлов, статистики считаются по разделам
 if uploaded_file is not None:
-    data = load_data(uploaded_file)
+    dataset_key = content_hash("".join(content_hash(file.getvalue()) for file in uploaded_files).encode())
+    data, city_offsets = load_data(dataset_key, uploaded_files)
     st.write("Превью данных:")
     st.dataframe(data[:100]) # ограничиваем для слишком больших входных данных
-    cities = data["city"].unique()
-    data_updated, city_profiles, season_profiles = parallel_city_statistics(data)
-    if data_updated.empty:
-        st.error("Данные по аномалиям не рассчитались, проверьте загружаемый файл.")
-    if city_profiles.empty:
-        st.error("Статистика по городам не рассчиталась, проверьте загружаемый файл.")
-    if season_profiles.empty:
-        st.error("Профиль сезона не рассчитался, проверьте загружаемый файл.")
+    cities = list(city_offsets)
+    if data.empty:
+        st.error("В загруженных файлах нет наблюдений, проверьте загружаемый файл.")
 else:
-    st.write("Пожалуйста, загрузите CSV-файл.")
+    st.write("Пожалуйста, загрузите CSV- или Parquet-файлы.")
 
 # Выбор города
 if uploaded_file is not None:
     if cities is not None:
         city = st.sidebar.selectbox("Выберите город", cities)
-        if not data_updated.empty and not city_profiles.empty and not season_profiles.empty:
-            data_city = data_updated[data_updated["city"] == city].copy().reset_index(drop=True)
-            city_profile = city_profiles[city_profiles["city"] == city].copy().reset_index(drop=True)
-            season_profile = season_profiles[season_profiles["city"] == city].copy().reset_index(drop=True)
-        else:
-            st.error("Файлы статистик пустые, проверьте загружаемый файл.")
     else:
         st.write("В загруженном файле отсутствует колонка city.")
 
@@ -53,7 +99,8 @@ if uploaded_file is not None:
         st.warning("Введите API-ключ, чтобы получить данные текущей температуры.")
     else:
         if city is not None:
-            response = get_response(city, api_key)
+            # асинхронный клиент с TTL-кэшем: повторные запуски скрипта не ходят в API 10 минут
+            response = get_responses([city], api_key)[city]
         else:
             st.write("Выберите город")
 
@@ -66,53 +113,75 @@ if uploaded_file is not None:
 
         if "temperature" in response:
             st.write(f"Сейчас в {city}: {current_temp}°C {weather_icon}, сезон: {current_season}.")
-            anomaly_status = is_anomaly(city, current_season, current_temp, season_profile)
+            # (город, сезон) -> (среднее, std) только по выбранному городу
+            season_index = build_season_index(load_season_profile(dataset_key, city, data, city_offsets))
+            anomaly_status = is_anomaly(city, current_season, current_temp, season_index)
             status = "нормальная" if not anomaly_status else "аномальная"
             st.write(f"Температура {status} для сезона.")
 
+        # Текущая температура во всех городах: запросы параллельно, аномальность одним вызовом
+        if st.checkbox("Показать текущую температуру во всех городах"):
+            responses = get_responses(cities, api_key)
+            current = pd.DataFrame([{"city": city_name, **city_response}
+                                    for city_name, city_response in responses.items()
+                                    if "temperature" in city_response])
+            errors = {city_name: city_response["error"]
+                      for city_name, city_response in responses.items() if "error" in city_response}
+
+            if not current.empty:
+                current["is_anomaly"] = is_anomaly_batch(current["city"], current["season"], current["temperature"],
+                                                         load_season_index(dataset_key, data))
+                current["status"] = current["is_anomaly"].map({True: "аномальная", False: "нормальная"})
+                st.write(current[["city", "temperature", "weather_icon", "season", "status"]].set_index("city"))
+            for city_name, error in errors.items():
+                st.error(f"{city_name}: {error}")
+
 # Профиль сезона
-if uploaded_file is not None and city is not None and not season_profile.empty:
+if uploaded_file is not None and city is not None:
     st.header("3. Температурный профиль сезона")
 
     if st.checkbox("Показать сезонный профиль"):
+        season_profile = load_season_profile(dataset_key, city, data, city_offsets)
         st.write(f"**Сезонный профиль для {city}**")
         st.write(season_profile.set_index("city").round(2))
 
 # Описательные статистики
-if uploaded_file is not None and city is not None and not data_city.empty:
+if uploaded_file is not None and city is not None:
     st.header("4. Основные статистики")
 
     if st.checkbox("Показать описательную статистику"):
-        data_filtred = data_city[["city", "season", "temperature"]]
+        cube = load_city_cube(dataset_key, city, data, city_offsets)
         st.write(f"**Описательные статистики для {city}**")
-        st.write(data_filtred.groupby(["city", "season"]).describe().round(2))
-
-        # Боксплот
-        fig = px.box(data_filtred, x="season", y="temperature",
-                     title=f"Распределение температуры по сезонам в {city}",
-                     labels={"season": "Сезон", "temperature": "Температура, °C"},
-                     color="season", color_discrete_sequence=px.colors.qualitative.Pastel
-                     )
+        st.write(cube_describe(cube, city).round(2))
+
+        # Боксплот по готовым квартилям и усам из куба, выбросы — отдельными точками, как в px.box
+        fig = go.Figure()
+        for (_, box), color in zip(cube_box(cube, city).iterrows(), px.colors.qualitative.Pastel):
+            fig.add_trace(go.Box(x=[box["season"]], q1=[box["q1"]], median=[box["median"]], q3=[box["q3"]],
+                                 mean=[box["mean"]], lowerfence=[box["lowerfence"]],
+                                 upperfence=[box["upperfence"]], name=box["season"], marker_color=color,
+                                 legendgroup=box["season"]))
+            fig.add_trace(go.Scatter(x=[box["season"]] * len(box["outliers"]), y=box["outliers"],
+                                     mode="markers", marker_color=color, legendgroup=box["season"],
+                                     showlegend=False, name=box["season"]))
+
+        fig.update_layout(title=f"Распределение температуры по сезонам в {city}",
+                          xaxis_title="Сезон", yaxis_title="Температура, °C", legend_title="season")
 
         st.plotly_chart(fig)
 
 # Динамика
-if uploaded_file is not None and city is not None and not city_profile.empty:
+if uploaded_file is not None and city is not None:
     st.header("5. Динамика температуры")
 
     if st.checkbox("Показать динамику"):
+        data_city, city_profile, _ = load_city_statistics(dataset_key, city, WINDOW, data, city_offsets)
+        cube = load_city_cube(dataset_key, city, data, city_offsets)
         st.write(f"**Профиль города {city}**")
         st.write(city_profile.set_index("city").round(2))
 
         # Фильтр по годам
-        data_city_dynamic = data_city.copy()
-        data_city_dynamic["is_anomaly"] = data_city_dynamic["is_anomaly"] \
-                .fillna("undefined") \
-                .apply(lambda x: "anomaly" if x == 1.0 else "normal" if x == 0.0 else x)
-
-        data_city_dynamic["year"] = data_city_dynamic["timestamp"].dt.year
-
-        available_years = sorted(data_city_dynamic["year"].unique())
+        available_years = cube_years(cube, city)
         all_years_option = "Выбрать все"
         select_options = [all_years_option] + available_years
 
@@ -126,15 +195,22 @@ if uploaded_file is not None and city is not None and not city_profile.empty:
         if all_years_option in selected_years:
             selected_years = available_years
 
-        data_city_dynamic_filtred = data_city_dynamic[data_city_dynamic["year"].isin(selected_years)]
+        # маска по годам вместо копии среза города с дописанным столбцом year
+        data_city_dynamic_filtred = data_city[data_city["timestamp"].dt.year.isin(selected_years).to_numpy()]
 
         if data_city_dynamic_filtred.empty:
             st.warning("Нет данных для выбранных периодов.")
         else:
             # График динамики
-            # Динамика по всем наблюдениям
+            # В браузер отправляем прореженные ряды: min/max температуры по бакетам и все аномалии,
+            # линии — LTTB, не больше MAX_PLOT_POINTS точек на ряд
+            plot_points, plot_lines = downsample_city_series(data_city_dynamic_filtred)
+            # подписи флагов аномалий — только для отправляемых точек
+            plot_points = plot_points.assign(is_anomaly=anomaly_labels(plot_points["is_anomaly"]))
+
+            # Динамика по наблюдениям
             fig = px.scatter(
-                data_city_dynamic_filtred,
+                plot_points,
                 x="timestamp",
                 y="temperature",
                 color="is_anomaly",
@@ -150,8 +226,8 @@ if uploaded_file is not None and city is not None and not city_profile.empty:
 
             # Скользящее среднее
             fig.add_scatter(
-                x=data_city_dynamic_filtred["timestamp"],
-                y=data_city_dynamic_filtred["rolling_mean"],
+                x=plot_lines["rolling_mean"]["timestamp"],
+                y=plot_lines["rolling_mean"]["rolling_mean"],
                 mode="lines",
                 name="Скользящее среднее",
                 line=dict(color="orange")
@@ -159,8 +235,8 @@ if uploaded_file is not None and city is not None and not city_profile.empty:
 
             # Тренд
             fig.add_scatter(
-                x=data_city_dynamic_filtred["timestamp"],
-                y=data_city_dynamic_filtred["trend"],
+                x=plot_lines["trend"]["timestamp"],
+                y=plot_lines["trend"]["trend"],
                 mode="lines",
                 name="Линия тренда",
                 line=dict(color="green")
@@ -198,23 +274,8 @@ if uploaded_file is not None and city is not None and not city_profile.empty:
             st.plotly_chart(fig)
 
             # Круговая диаграмма частотности температуры
-            # Подготовка данных
-            data_city_polar = data_city_dynamic_filtred.copy()
-            data_city_polar["month"] = data_city_polar["timestamp"].dt.month_name()
-            data_city_polar["day"] = data_city_polar["timestamp"].dt.day
-            data_city_polar['temperature'] = data_city_polar.temperature.round()
-
-            data_city_polar_agg = data_city_polar.groupby(['city', 'month', 'temperature']) \
-                .agg(days_count=('day', 'count')).reset_index()
-
-            month_order = [
-                "January", "February", "March", "April", "May", "June",
-                "July", "August", "September", "October", "November", "December"]
-
-            data_city_polar_agg["month"] = pd.Categorical(data_city_polar_agg["month"],
-                                                          categories=month_order, ordered=True)
-
-            data_city_polar_agg = data_city_polar_agg.sort_values(["month", "temperature"])
+            # Число дней по (месяц, округленная температура) за выбранные годы — из куба предагрегатов
+            data_city_polar_agg = cube_month_histogram(cube, city, selected_years)
 
             # Polar bar
             fig = px.bar_polar(
@@ -237,4 +298,45 @@ if uploaded_file is not None and city is not None and not city_profile.empty:
                 )
             )
 
-            st.plotly_chart(fig)
\ No newline at end of file
+            st.plotly_chart(fig)
+
+# Профили всех городов: долгий расчет чанками городов с прогресс-баром, готовые города выводятся сразу.
+# Состояние расчета лежит в session_state: перезапуск скрипта (смена виджета) продолжает с непосчитанных
+# городов, кнопка остановки отменяет оставшиеся чанки, посчитанные профили остаются
+if uploaded_file is not None and not data.empty:
+    st.header("6. Профили всех городов")
+
+    if st.checkbox("Рассчитать профили всех городов"):
+        run = st.session_state.setdefault(f"all_cities:{dataset_key}:{WINDOW}",
+                                          {"profiles": [], "done_rows": 0, "cancel": threading.Event()})
+        if run["cancel"].is_set():
+            st.button("Продолжить расчет", on_click=run["cancel"].clear)
+        else:
+            st.button("Остановить расчет", on_click=run["cancel"].set)
+
+        progress_bar = st.progress(run["done_rows"] / len(data))
+        profiles_table = st.empty()
+        if run["profiles"]:
+            profiles_table.dataframe(pd.concat(run["profiles"], ignore_index=True).set_index("city").round(2))
+
+        if run["done_rows"] < len(data) and not run["cancel"].is_set():
+            done_cities = {city_name for profile in run["profiles"] for city_name in profile["city"]}
+            remaining = data[~data["city"].isin(done_cities)] if done_cities else data
+
+            for done_rows, total_rows, (_, city_profile_chunk, _) in iter_city_statistics(
+                    remaining, window_days=WINDOW, cancel=run["cancel"]):
+                run["profiles"].append(city_profile_chunk)
+                run["done_rows"] = len(data) - total_rows + done_rows
+                progress_bar.progress(run["done_rows"] / len(data),
+                                      text=f"Посчитано городов: {sum(map(len, run['profiles']))} из {len(cities)}")
+                profiles_table.dataframe(pd.concat(run["profiles"], ignore_index=True).set_index("city").round(2))
+
+        if run["cancel"].is_set() and run["done_rows"] < len(data):
+            st.warning("Расчет остановлен, показаны посчитанные города.")
+
+# Производительность этого запуска скрипта: время и память этапов, пиковая память процесса
+profile_run.stop()
+with st.expander("Производительность"):
+    st.write(f"Запуск скрипта: {profile_run.elapsed:.2f} с")
+    st.dataframe(profile_run.summary().set_index("stage").round(3))
+    st.write({name: round(value, 1) for name, value in profile_run.memory().items()})
\ No newline at end of file
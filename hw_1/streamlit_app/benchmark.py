@@ -0,0 +1,413 @@
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+from ingestion import load_temperature_data, load_temperature_files
+from plot_data import downsample_city_series, month_temperature_histogram
+from processing import (anomaly_labels, grouped_rolling, month_to_season, parallel_city_statistics,
+                        serial_city_statistics, shared_memory_city_statistics, sort_by_city, timestamp_seconds,
+                        vectorized_city_statistics)
+from profiling import peak_rss_mb
+from shards import shard_temperature_files, sharded_city_statistics
+from weather_client import TTLCache, WeatherClient
+
+# Бенчмарки из папки streamlit_app:
+#   python benchmark.py engines --scale 10       — движки расчета статистик на увеличенном temperature_data.csv
+#   python benchmark.py ingest --rows 50000000   — загрузка синтетического CSV: время и пик памяти
+#   python benchmark.py weather --latency 0.2    — клиент текущей погоды против локального stub-сервера
+#   python benchmark.py plots --years 30         — данные графиков динамики города: объем и время подготовки
+#   python benchmark.py memory --rows 50000000   — пиковый RSS и размер обогащенного датафрейма по раскладкам
+#   python benchmark.py windows --years 20       — скользящие окна по времени на почасовых рядах с пропусками
+#   python benchmark.py files --files 200        — чтение многих выгрузок пулом потоков и расчет по шардам
+
+# Сезонные нормы городов, как в генераторе данных из ноутбука
+seasonal_temperatures = {
+    "New York": {"winter": 0, "spring": 10, "summer": 25, "autumn": 15},
+    "London": {"winter": 5, "spring": 11, "summer": 18, "autumn": 12},
+    "Paris": {"winter": 4, "spring": 12, "summer": 20, "autumn": 13},
+    "Tokyo": {"winter": 6, "spring": 15, "summer": 27, "autumn": 18},
+    "Moscow": {"winter": -10, "spring": 5, "summer": 18, "autumn": 8},
+    "Sydney": {"winter": 12, "spring": 18, "summer": 25, "autumn": 20},
+    "Berlin": {"winter": 0, "spring": 10, "summer": 20, "autumn": 11},
+    "Beijing": {"winter": -2, "spring": 13, "summer": 27, "autumn": 16},
+    "Rio de Janeiro": {"winter": 20, "spring": 25, "summer": 30, "autumn": 25},
+    "Dubai": {"winter": 20, "spring": 30, "summer": 40, "autumn": 30},
+    "Los Angeles": {"winter": 15, "spring": 18, "summer": 25, "autumn": 20},
+    "Singapore": {"winter": 27, "spring": 28, "summer": 28, "autumn": 27},
+    "Mumbai": {"winter": 25, "spring": 30, "summer": 35, "autumn": 30},
+    "Cairo": {"winter": 15, "spring": 25, "summer": 35, "autumn": 25},
+    "Mexico City": {"winter": 12, "spring": 18, "summer": 20, "autumn": 15},
+}
+
+
+season_names = ["winter", "spring", "summer", "autumn"]
+
+
+# Векторная версия генератора из ноутбука: сезонная норма + нормальный шум со std 5.
+# Города сверх 15 базовых получают профиль базового города и суффикс с номером копии.
+# city и season — категории, как после ingestion.load_temperature_data
+# n_days — число наблюдений на город, freq — их частота ("D", "h", "min")
+def generate_temperature_data(n_cities, n_years=10, city_offset=0, seed=0, n_days=None, freq="D"):
+    rng = np.random.default_rng(seed + city_offset)
+    dates = pd.date_range(start="2010-01-01", periods=n_days or 365 * n_years, freq=freq)
+    season_codes = pd.Index(season_names).get_indexer(dates.month.map(month_to_season))
+
+    base_cities = list(seasonal_temperatures)
+    city_ids = np.arange(city_offset, city_offset + n_cities)
+    cities = [base_cities[i % len(base_cities)] if i < len(base_cities)
+              else f"{base_cities[i % len(base_cities)]} #{i // len(base_cities)}" for i in city_ids]
+    norms = np.array([[seasonal_temperatures[city][season] for season in season_names] for city in base_cities])
+    mean_temp = norms[city_ids % len(base_cities)][:, season_codes]
+
+    return pd.DataFrame({
+        "city": pd.Categorical.from_codes(np.repeat(np.arange(n_cities), len(dates)), categories=cities),
+        "timestamp": np.tile(dates.to_numpy(), n_cities),
+        "temperature": rng.normal(loc=mean_temp, scale=5).ravel(),
+        "season": pd.Categorical.from_codes(np.tile(season_codes, n_cities), categories=season_names)
+    })
+
+
+# Синтетический CSV из n_rows строк (n_cities городов или по 10 лет на город),
+# пишется порциями примерно по batch_rows строк
+def write_synthetic_csv(path, n_rows, n_cities=None, freq="D", batch_rows=1_000_000):
+    n_cities = n_cities or -(-n_rows // (365 * 10))
+    n_days = -(-n_rows // n_cities)
+    cities_per_batch = max(1, batch_rows // n_days)
+    date_format = "%Y-%m-%d" if freq == "D" else "%Y-%m-%d %H:%M:%S"
+
+    for city_offset in range(0, n_cities, cities_per_batch):
+        batch = generate_temperature_data(min(cities_per_batch, n_cities - city_offset),
+                                          city_offset=city_offset, n_days=n_days, freq=freq)
+        batch["timestamp"] = batch["timestamp"].dt.strftime(date_format)
+        batch.to_csv(path, mode="w" if city_offset == 0 else "a", header=city_offset == 0, index=False)
+
+
+# Увеличиваем данные: копии всех городов под новыми именами
+def scale_dataset(df, scale):
+    copies = [df.assign(city=df["city"] + f" #{i}") for i in range(scale)]
+    return pd.concat(copies, ignore_index=True)
+
+
+def measure(func, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_engines(args):
+    df = pd.read_csv(args.path)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    df = scale_dataset(df, args.scale)
+    print(f"Строк: {len(df)}, городов: {df['city'].nunique()}")
+
+    engines = {
+        "serial": serial_city_statistics,
+        "parallel": parallel_city_statistics,
+        "vectorized": vectorized_city_statistics,
+        "shared_memory": shared_memory_city_statistics
+    }
+
+    for name, engine in engines.items():
+        print(f"{name:>12}: {measure(engine, df, args.repeat):.3f} с")
+
+
+# Прежняя загрузка из app.py: типы выводятся, строки остаются object
+def load_untyped(path):
+    df = pd.read_csv(path)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+def run_ingest(args):
+    if not os.path.exists(args.csv):
+        print(f"Генерируем {args.rows} строк в {args.csv}")
+        write_synthetic_csv(args.csv, args.rows)
+    print(f"Файл: {args.csv}, {os.path.getsize(args.csv) / 2 ** 20:.0f} MB")
+
+    loaders = {
+        "read_csv (untyped)": load_untyped,
+        "chunked typed": lambda path: load_temperature_data(path)[0],
+        "pyarrow typed": lambda path: load_temperature_data(path, engine="pyarrow")[0]
+    }
+
+    for name, loader in loaders.items():
+        tracemalloc.start()
+        start = time.perf_counter()
+        df = loader(args.csv)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        frame_size = df.memory_usage(deep=True).sum()
+        print(f"{name:>20}: {elapsed:.2f} с, пик памяти {peak / 2 ** 20:.0f} MB, "
+              f"датафрейм {frame_size / 2 ** 20:.0f} MB")
+        del df
+
+
+# Почасовые ряды за n_years лет. irregular: у четных городов выброшено 20% наблюдений,
+# нечетные города — один замер в сутки (смешанная частота)
+def hourly_dataset(n_cities, n_years, irregular):
+    df = generate_temperature_data(n_cities, n_days=n_years * 365 * 24, freq="h")
+    if not irregular:
+        return df
+
+    daily_city = df["city"].cat.codes.to_numpy() % 2 == 1
+    hour = df["timestamp"].dt.hour.to_numpy()
+    dropped = np.random.default_rng(1).random(len(df)) < 0.2
+    keep = np.where(daily_city, hour == 12, ~dropped)
+    return df[keep].reset_index(drop=True)
+
+
+# Прежний путь для нерегулярных рядов: ресемплинг каждого города на почасовую сетку, затем окно из 720 строк
+def resampled_rolling(df):
+    hourly = df.set_index("timestamp").groupby("city", observed=True)["temperature"].resample("h").mean()
+    return hourly.groupby(level="city", observed=True).rolling(30 * 24, min_periods=2).agg(["mean", "std"])
+
+
+def run_windows(args):
+    for irregular in (False, True):
+        df = hourly_dataset(args.cities, args.years, irregular)
+        df, codes, cities, starts, counts = sort_by_city(df)
+        temperature = df["temperature"].to_numpy(dtype=np.float64)
+        x = timestamp_seconds(df["timestamp"])
+        print(f"{'нерегулярные' if irregular else 'регулярные'} ряды: строк {len(df)}, городов {len(cities)}")
+
+        methods = {
+            "окно 720 строк": lambda: grouped_rolling(temperature, starts, counts, 30 * 24),
+            "окно 30D": lambda: grouped_rolling(temperature, starts, counts, "30D", x),
+            "groupby.rolling 30D": lambda: df.groupby("city", observed=True)
+                                             .rolling("30D", on="timestamp")["temperature"].agg(["mean", "std"]),
+            "ресемплинг + 720 строк": lambda: resampled_rolling(df),
+            "статистики 30D": lambda: vectorized_city_statistics(df.copy(), window_days="30D")
+        }
+        for name, method in methods.items():
+            print(f"{name:>24}: {measure(lambda _: method(), None, args.repeat):.3f} с")
+
+
+# Выгрузки станций: n_files файлов по cities_per_file своих городов, каждый второй — Parquet
+def write_station_exports(directory, n_files, cities_per_file, n_years):
+    for i in range(n_files):
+        df = generate_temperature_data(cities_per_file, n_years, city_offset=i * cities_per_file)
+        path = os.path.join(directory, f"station_{i:04d}")
+        if i % 2:
+            df.to_parquet(path + ".parquet", index=False)
+        else:
+            df.assign(timestamp=df["timestamp"].dt.strftime("%Y-%m-%d")).to_csv(path + ".csv", index=False)
+
+
+def run_files(args):
+    directory = tempfile.mkdtemp(prefix="temperature_exports_")
+    try:
+        exports_dir, shard_dir = os.path.join(directory, "exports"), os.path.join(directory, "shards")
+        os.makedirs(exports_dir)
+        write_station_exports(exports_dir, args.files, args.cities_per_file, args.years)
+        print(f"Выгрузок: {args.files}, городов: {args.files * args.cities_per_file}")
+
+        start = time.perf_counter()
+        df = load_temperature_files([exports_dir], max_workers=1)[0]
+        print(f"{'чтение по одному':>24}: {time.perf_counter() - start:.2f} с, строк {len(df)}")
+        start = time.perf_counter()
+        load_temperature_files([exports_dir])
+        print(f"{'чтение пулом потоков':>24}: {time.perf_counter() - start:.2f} с")
+
+        start = time.perf_counter()
+        vectorized_city_statistics(df)
+        print(f"{'статистики целиком':>24}: {time.perf_counter() - start:.2f} с")
+        del df
+
+        start = time.perf_counter()
+        shards = shard_temperature_files([exports_dir], shard_dir)
+        print(f"{'раскладка по шардам':>24}: {time.perf_counter() - start:.2f} с, шардов {len(shards)}")
+        start = time.perf_counter()
+        sharded_city_statistics(shard_dir)
+        print(f"{'статистики по шардам':>24}: {time.perf_counter() - start:.2f} с, процессов {os.cpu_count()}")
+    finally:
+        shutil.rmtree(directory)
+
+
+# Прежняя раскладка обогащенного датафрейма: строки — object, все числа — float64, флаг аномалии — float NaN/0/1
+def untyped_layout(path):
+    df = vectorized_city_statistics(load_untyped(path))[0]
+    for column in ("rolling_mean", "rolling_std", "trend", "is_anomaly"):
+        df[column] = df[column].astype(np.float64)
+    return df
+
+
+# Текущая раскладка: категории, float32 и nullable Int8
+def compact_layout(path):
+    return vectorized_city_statistics(load_temperature_data(path)[0])[0]
+
+
+memory_layouts = {"object/float64": untyped_layout, "category/float32": compact_layout}
+
+
+def run_memory(args):
+    if args.layout is None:
+        if not os.path.exists(args.csv):
+            print(f"Генерируем {args.rows} строк в {args.csv}")
+            write_synthetic_csv(args.csv, args.rows)
+        # пиковый RSS процесса не сбрасывается, поэтому каждая раскладка — в отдельном процессе
+        for layout in memory_layouts:
+            subprocess.run([sys.executable, __file__, "memory", "--csv", args.csv, "--layout", layout], check=True)
+        return
+
+    start = time.perf_counter()
+    df = memory_layouts[args.layout](args.csv)
+    elapsed = time.perf_counter() - start
+    frame_size = df.memory_usage(deep=True).sum()
+    print(f"{args.layout:>18}: {elapsed:.1f} с, пик RSS {peak_rss_mb():.0f} MB, "
+          f"датафрейм {frame_size / 2 ** 20:.0f} MB ({frame_size / len(df):.1f} байт на строку)")
+
+
+# Stub-сервер OpenWeatherMap: ответ в формате API после задержки latency, город "Nowhere" — 404
+def stub_weather_app(latency):
+    async def weather(request):
+        await asyncio.sleep(latency)
+        city = request.query["q"]
+        if city == "Nowhere":
+            return web.json_response({"cod": "404", "message": "city not found"}, status=404)
+        return web.json_response({
+            "main": {"temp": seasonal_temperatures.get(city.split(" #")[0], {}).get("winter", 0)},
+            "dt": int(time.time()),
+            "timezone": 0,
+            "weather": [{"main": "Clear"}]
+        })
+
+    app = web.Application()
+    app.router.add_get("/data/2.5/weather", weather)
+    return app
+
+
+async def weather_benchmark(args):
+    runner = web.AppRunner(stub_weather_app(args.latency))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}/data/2.5/weather"
+
+    cities = list(seasonal_temperatures) + ["Nowhere"]
+    cache = TTLCache()
+    runs = {
+        "sequential": {"concurrency": 1, "cache": TTLCache()},
+        "concurrent": {"concurrency": 10, "cache": cache},
+        "cached": {"concurrency": 10, "cache": cache}
+    }
+
+    try:
+        for name, options in runs.items():
+            start = time.perf_counter()
+            async with WeatherClient("stub-key", base_url=base_url, **options) as client:
+                responses = await client.fetch_all(cities)
+            elapsed = time.perf_counter() - start
+            errors = sum("error" in response for response in responses.values())
+            print(f"{name:>12}: {elapsed:.3f} с, городов {len(cities)}, ошибок {errors}")
+    finally:
+        await runner.cleanup()
+
+
+def run_weather(args):
+    asyncio.run(weather_benchmark(args))
+
+
+# Объем данных графика в JSON: то, что plotly сериализует в браузер (x, y и цвет точек)
+def plot_payload(points, lines):
+    size = len(points[["timestamp", "temperature", "is_anomaly"]].to_json(orient="values", date_format="iso"))
+    return size + sum(len(line.to_json(orient="values", date_format="iso")) for line in lines.values())
+
+
+def run_plots(args):
+    # один город с почасовыми наблюдениями за years лет
+    dates = pd.date_range("1990-01-01", periods=args.years * 365 * 24, freq="h")
+    seasons = np.array([month_to_season[month] for month in range(1, 13)])[dates.month - 1]
+    df = pd.DataFrame({"city": "Moscow", "timestamp": dates,
+                       "temperature": np.random.default_rng(0).normal(5, 10, len(dates)), "season": seasons})
+    df = vectorized_city_statistics(df, window_days=30 * 24)[0]
+    print(f"Строк: {len(df)}")
+
+    full_lines = {column: df[["timestamp", column]] for column in ("rolling_mean", "trend")}
+    start = time.perf_counter()
+    points, lines = downsample_city_series(df)
+    points = points.assign(is_anomaly=anomaly_labels(points["is_anomaly"]))
+    downsample_time = time.perf_counter() - start
+    full_points = df.assign(is_anomaly=anomaly_labels(df["is_anomaly"]))
+    print(f"{'все точки':>14}: {plot_payload(full_points, full_lines) / 2 ** 20:.1f} MB")
+    print(f"{'прореживание':>14}: {plot_payload(points, lines) / 2 ** 20:.2f} MB, "
+          f"точек {len(points)} + линии по {len(lines['trend'])}, {downsample_time:.3f} с")
+
+    start = time.perf_counter()
+    polar = df.copy()
+    polar["month"] = polar["timestamp"].dt.month_name()
+    polar["temperature"] = polar.temperature.round()
+    polar.groupby(["city", "month", "temperature"], observed=True).agg(days_count=("timestamp", "count"))
+    groupby_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    month_temperature_histogram(df)
+    histogram_time = time.perf_counter() - start
+    print(f"{'гистограмма':>14}: groupby по названиям месяцев {groupby_time:.3f} с, bincount {histogram_time:.3f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки аналитики температуры")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    engines = subparsers.add_parser("engines", help="движки расчета статистик")
+    engines.add_argument("--path", default="../temperature_data.csv")
+    engines.add_argument("--scale", type=int, default=10, help="во сколько раз увеличить число городов")
+    engines.add_argument("--repeat", type=int, default=3)
+    engines.set_defaults(func=run_engines)
+
+    ingest = subparsers.add_parser("ingest", help="загрузка CSV")
+    ingest.add_argument("--rows", type=int, default=50_000_000)
+    ingest.add_argument("--csv", default="synthetic_temperature_data.csv",
+                        help="файл создается, если его еще нет")
+    ingest.set_defaults(func=run_ingest)
+
+    weather = subparsers.add_parser("weather", help="запросы текущей погоды")
+    weather.add_argument("--latency", type=float, default=0.2, help="задержка ответа stub-сервера, с")
+    weather.set_defaults(func=run_weather)
+
+    plots = subparsers.add_parser("plots", help="подготовка данных графиков")
+    plots.add_argument("--years", type=int, default=30, help="лет почасовых наблюдений одного города")
+    plots.set_defaults(func=run_plots)
+
+    memory = subparsers.add_parser("memory", help="память обогащенного датафрейма")
+    memory.add_argument("--rows", type=int, default=50_000_000)
+    memory.add_argument("--csv", default="synthetic_temperature_data.csv",
+                        help="файл создается, если его еще нет")
+    memory.add_argument("--layout", choices=tuple(memory_layouts),
+                        help="замерить одну раскладку в этом процессе (иначе все, каждую в своем процессе)")
+    memory.set_defaults(func=run_memory)
+
+    windows = subparsers.add_parser("windows", help="временные скользящие окна на почасовых данных")
+    windows.add_argument("--years", type=int, default=20, help="лет почасовых наблюдений на город")
+    windows.add_argument("--cities", type=int, default=10)
+    windows.add_argument("--repeat", type=int, default=3)
+    windows.set_defaults(func=run_windows)
+
+    files = subparsers.add_parser("files", help="много файлов выгрузок и шарды городов")
+    files.add_argument("--files", type=int, default=200)
+    files.add_argument("--cities-per-file", type=int, default=5)
+    files.add_argument("--years", type=int, default=10)
+    files.set_defaults(func=run_files)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
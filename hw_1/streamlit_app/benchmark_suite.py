@@ -0,0 +1,195 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmark import generate_temperature_data, write_synthetic_csv
+from ingestion import load_temperature_data
+from processing import (build_season_index, is_anomaly, is_anomaly_batch, parallel_city_statistics,
+                        seasonal_decomposition, serial_city_statistics, shared_memory_city_statistics,
+                        vectorized_city_statistics)
+
+# Набор бенчмарков processing.py по сетке размеров данных (строки × города), в духе asv.
+#   python benchmark_suite.py run --rows 100000 1000000 --cities 10 100 1000
+#   python benchmark_suite.py compare          — последний прогон против предыдущего
+# Для каждого бенчмарка замеряются холодный запуск (первый вызов в процессе: старт пула,
+# прогрев кэшей) и теплый (минимум из repeat следующих вызовов).
+# Результаты пишутся в benchmark_results/<время>_<коммит>.json, чтобы регрессии было видно между коммитами
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+DATA_DIR = os.environ.get("BENCHMARK_DATA_DIR", "/tmp/temperature_benchmarks")
+# Во сколько раз теплое время может вырасти, прежде чем compare отметит регрессию
+REGRESSION_RATIO = 1.2
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment():
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+        "system": platform.system()
+    }
+
+
+# Частота наблюдений, при которой ряд города укладывается в диапазон дат pandas (до 2262 года)
+def observation_freq(n_observations):
+    for freq, per_year in (("D", 365), ("h", 365 * 24), ("min", 365 * 24 * 60)):
+        if n_observations / per_year < 200:
+            return freq
+    raise ValueError(f"Слишком много наблюдений на город: {n_observations}")
+
+
+# Холодный и теплый замер: setup() готовит аргумент заново для каждого вызова,
+# в замер не входит (функции статистик дописывают столбцы во входной датафрейм)
+def time_benchmark(func, setup, repeat):
+    timings = []
+    for _ in range(repeat + 1):
+        arg = setup()
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+
+    return {"cold": timings[0], "warm": min(timings[1:])}
+
+
+def benchmarks(n_rows, df, season_index, season_profile, csv_path, slow_max_rows):
+    # проверяем только пары (город, сезон), которые есть в профиле
+    rng = np.random.default_rng(0)
+    keys = np.array(list(season_index), dtype=object)[rng.integers(0, len(season_index), 10000)]
+    checks = {
+        "cities": keys[:, 0].astype(str),
+        "seasons": keys[:, 1].astype(str),
+        "temperatures": rng.normal(15, 15, 10000)
+    }
+
+    cases = {
+        "load_csv": (lambda path: load_temperature_data(path), lambda: csv_path),
+        "vectorized_city_statistics": (vectorized_city_statistics, df.copy),
+        "vectorized_city_statistics (30D)": (lambda df: vectorized_city_statistics(df, window_days="30D"), df.copy),
+        "shared_memory_city_statistics": (shared_memory_city_statistics, df.copy),
+        "seasonal_decomposition": (seasonal_decomposition, lambda: df),
+        # 100 одиночных проверок по датафрейму профиля, как в app.py до индекса
+        "is_anomaly_x100": (lambda checks: [is_anomaly(city, season, temperature, season_profile)
+                                            for city, season, temperature in zip(checks["cities"][:100],
+                                                                                 checks["seasons"][:100],
+                                                                                 checks["temperatures"][:100])],
+                            lambda: checks),
+        "is_anomaly_batch_x10000": (lambda checks: is_anomaly_batch(checks["cities"], checks["seasons"],
+                                                                    checks["temperatures"], season_index),
+                                    lambda: checks)
+    }
+    # последовательный цикл и пул с копией датафрейма на город — только на небольших данных
+    if n_rows <= slow_max_rows:
+        cases["city_statistics (serial)"] = (serial_city_statistics, df.copy)
+        cases["parallel_city_statistics"] = (parallel_city_statistics, df.copy)
+
+    return cases
+
+
+def run_suite(args):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results = []
+
+    for n_rows in args.rows:
+        for n_cities in args.cities:
+            n_days = n_rows // n_cities
+            if n_days < args.min_days:
+                continue
+
+            freq = observation_freq(n_days)
+            df = generate_temperature_data(n_cities, n_days=n_days, freq=freq)
+            csv_path = os.path.join(DATA_DIR, f"temperature_{n_rows}_{n_cities}.csv")
+            if not os.path.exists(csv_path):
+                write_synthetic_csv(csv_path, len(df), n_cities, freq)
+            season_profile = vectorized_city_statistics(df.copy())[2]
+            season_index = build_season_index(season_profile)
+
+            cases = benchmarks(n_rows, df, season_index, season_profile, csv_path, args.slow_max_rows)
+            for name, (func, setup) in cases.items():
+                if args.only and not any(pattern in name for pattern in args.only):
+                    continue
+                timing = time_benchmark(func, setup, args.repeat)
+                results.append({"benchmark": name, "rows": len(df), "cities": n_cities, **timing})
+                print(f"{name:>32} rows={len(df):>11} cities={n_cities:>6}: "
+                      f"cold {timing['cold']:8.3f} с, warm {timing['warm']:8.3f} с")
+
+    env = environment()
+    path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}_{env['commit']}.json")
+    with open(path, "w") as f:
+        json.dump({"environment": env, "results": results}, f, indent=2)
+    print(f"Результаты: {path}")
+
+
+def load_results(path):
+    with open(path) as f:
+        run = json.load(f)
+    return run["environment"], {(r["benchmark"], r["rows"], r["cities"]): r for r in run["results"]}
+
+
+# Сравнение теплых времен двух прогонов по общим бенчмаркам
+def compare(args):
+    paths = args.runs or sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))[-2:]
+    if len(paths) < 2:
+        print("Нужно минимум два прогона для сравнения")
+        return
+
+    (old_env, old), (new_env, new) = load_results(paths[0]), load_results(paths[1])
+    print(f"{old_env['commit']} -> {new_env['commit']}")
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key]["warm"] / old[key]["warm"]
+        mark = "РЕГРЕССИЯ" if ratio > REGRESSION_RATIO else ""
+        regressions += bool(mark)
+        name, rows, cities = key
+        print(f"{name:>32} rows={rows:>11} cities={cities:>6}: "
+              f"{old[key]['warm']:8.3f} -> {new[key]['warm']:8.3f} с (x{ratio:.2f}) {mark}")
+
+    if regressions:
+        raise SystemExit(f"Регрессий: {regressions}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки processing.py по размерам данных")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="прогнать бенчмарки и сохранить результаты")
+    run.add_argument("--rows", type=int, nargs="+", default=[10 ** 5, 10 ** 6, 10 ** 7],
+                     help="размеры данных, до 10^8 строк")
+    run.add_argument("--cities", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--min-days", type=int, default=60,
+                     help="пропускать сочетания, где на город меньше дней (окно скользящих — 30)")
+    run.add_argument("--slow-max-rows", type=int, default=10 ** 6,
+                     help="до какого размера запускать последовательный цикл и пул процессов")
+    run.add_argument("--only", nargs="+", help="запускать только бенчмарки с этими подстроками в имени")
+    run.set_defaults(func=run_suite)
+
+    comparison = subparsers.add_parser("compare", help="сравнить два прогона")
+    comparison.add_argument("runs", nargs="*", help="файлы результатов: старый и новый")
+    comparison.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from ingestion import load_temperature_files
+from processing import BACKENDS, compute_city_statistics, parse_window, seasonal_decomposition, seasonal_forecast
+from profiling import ProfileRun, peak_rss_mb
+from shards import shard_temperature_files, sharded_city_statistics
+
+# Пакетный запуск расчета без Streamlit, например для ночной обработки архивов станций:
+#   python cli.py station_1.csv station_2.csv --backend vectorized --output results/
+#   python cli.py "exports/*.csv" exports_2024/ --shard-dir shards/ --output results/
+# Входные пути — файлы, папки или glob-шаблоны с CSV и Parquet. С --shard-dir выгрузки сначала
+# раскладываются по шардам городов, и статистики считаются по шардам независимо.
+# В папку output пишутся observations.parquet (наблюдения со скользящими статистиками,
+# трендом и флагом is_anomaly), city_profiles.parquet и season_profiles.parquet.
+# С --forecast N к наблюдениям добавляется сезонная модель (baseline, residual, is_seasonal_anomaly),
+# модели городов пишутся в seasonal_models.parquet, прогноз на N шагов — в forecast.parquet.
+# --stages печатает время и память этапов расчета, --profile пишет отчет профилировщика:
+#   python cli.py data.csv --stages --profile run.prof      (snakeviz run.prof)
+
+
+# Время и пиковая память этапа пайплайна; время добавляется в timings
+@contextmanager
+def stage(name, timings):
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    timings[name] = elapsed
+    print(f"{name:>10}: {elapsed:8.2f} с, пик RSS {peak_rss_mb():.0f} MB", file=sys.stderr)
+
+
+# Ctrl+C на время расчета не прерывает процесс, а отменяет оставшиеся чанки городов
+@contextmanager
+def interruptible(cancel):
+    previous = signal.signal(signal.SIGINT, lambda *_: cancel.set())
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+
+def print_progress(done_rows, total_rows, result):
+    print(f"{'progress':>10}: {done_rows / total_rows:6.1%} строк, готово городов в чанке: {len(result[1])}",
+          file=sys.stderr)
+
+
+def write_parquet(df, path):
+    df.to_parquet(path, engine="pyarrow", index=False)
+
+
+def print_stages(run):
+    for row in run.summary().itertuples(index=False):
+        print(f"{'stage':>10}: {row.seconds:8.2f} с, RSS {row.rss_delta_mb:+7.0f} MB, "
+              f"вызовов {row.calls:>4}  {row.stage}", file=sys.stderr)
+
+
+def run(args):
+    with ProfileRun(args.profile) as profile_run:
+        code = run_pipeline(args)
+    if args.stages:
+        print_stages(profile_run)
+    if args.profile:
+        print(f"Профиль: {args.profile}", file=sys.stderr)
+    return code
+
+
+def run_pipeline(args):
+    timings = {}
+    cancel = threading.Event()
+    # с --progress расчет идет чанками: прогресс в stderr, по Ctrl+C записываются уже посчитанные города
+    options = {"progress": print_progress, "cancel": cancel} if args.progress else {}
+
+    if args.shard_dir:
+        with stage("ingest", timings):
+            shards = shard_temperature_files(args.files, args.shard_dir, engine=args.engine)
+        print(f"Строк: {sum(rows for _, rows in shards)}, городов (шардов): {len(shards)}", file=sys.stderr)
+
+        with stage("compute", timings), interruptible(cancel):
+            data_updated, city_profiles, season_profiles = sharded_city_statistics(
+                args.shard_dir, window_days=args.window_days, trend_method=args.trend_method, **options)
+    else:
+        with stage("ingest", timings):
+            data, city_offsets = load_temperature_files(args.files, engine=args.engine)
+        print(f"Строк: {len(data)}, городов: {len(city_offsets)}", file=sys.stderr)
+
+        with stage("compute", timings), interruptible(cancel):
+            data_updated, city_profiles, season_profiles = compute_city_statistics(
+                data, window_days=args.window_days, trend_method=args.trend_method, backend=args.backend,
+                **options)
+        del data
+
+    if cancel.is_set():
+        print(f"Расчет остановлен, записываются посчитанные города: {len(city_profiles)}", file=sys.stderr)
+
+    if data_updated.empty or city_profiles.empty or season_profiles.empty:
+        print("Статистики не рассчитались, проверьте входные файлы.", file=sys.stderr)
+        return 1
+
+    if args.forecast:
+        with stage("seasonal", timings):
+            data_updated, seasonal_models = seasonal_decomposition(data_updated)
+            forecast = seasonal_forecast(seasonal_models, horizon=args.forecast)
+
+    with stage("write", timings):
+        os.makedirs(args.output, exist_ok=True)
+        if args.forecast:
+            write_parquet(seasonal_models, os.path.join(args.output, "seasonal_models.parquet"))
+            write_parquet(forecast, os.path.join(args.output, "forecast.parquet"))
+        if args.anomalies_only:
+            data_updated = data_updated[(data_updated["is_anomaly"] == 1).fillna(False)]
+        write_parquet(data_updated, os.path.join(args.output, "observations.parquet"))
+        write_parquet(city_profiles, os.path.join(args.output, "city_profiles.parquet"))
+        write_parquet(season_profiles, os.path.join(args.output, "season_profiles.parquet"))
+
+    print(f"{'total':>10}: {sum(timings.values()):8.2f} с", file=sys.stderr)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный расчет статистик температуры")
+    parser.add_argument("files", nargs="+",
+                        help="CSV/Parquet-файлы, папки или glob со столбцами city, timestamp, temperature, season")
+    parser.add_argument("--output", "-o", default="results", help="папка для parquet-файлов")
+    parser.add_argument("--backend", choices=BACKENDS, default="auto")
+    parser.add_argument("--engine", choices=("c", "pyarrow"), default="c", help="парсер CSV")
+    parser.add_argument("--shard-dir", help="пустая папка для шардов городов; расчет по шардам вместо --backend")
+    parser.add_argument("--window-days", type=parse_window, default=30,
+                        help="окно скользящих статистик: число наблюдений (30) или интервал времени (30D, 720h)")
+    parser.add_argument("--trend-method", choices=("ols", "theil_sen"), default="ols")
+    parser.add_argument("--progress", action="store_true",
+                        help="считать чанками с прогрессом; Ctrl+C записывает уже посчитанные города")
+    parser.add_argument("--anomalies-only", action="store_true",
+                        help="писать в observations.parquet только аномальные наблюдения")
+    parser.add_argument("--forecast", type=int, default=0, metavar="N",
+                        help="сезонная модель городов и прогноз на N шагов ряда вперед")
+    parser.add_argument("--stages", action="store_true", help="напечатать время и память этапов расчета")
+    parser.add_argument("--profile", help="файл профиля: *.prof (cProfile) или *.html (pyinstrument)")
+    args = parser.parse_args()
+
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
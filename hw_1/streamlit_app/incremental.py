@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+
+from processing import anomaly_flags, grouped_rolling, parse_window, sort_by_city, timestamp_seconds, trend_label
+
+# Инкрементальный пересчет статистик при дозагрузке наблюдений.
+# Вместо всей истории храним по каждому городу достаточные статистики (число наблюдений, среднее,
+# сумма квадратов отклонений, min/max, число аномалий, накопители МНК) и хвост из последних
+# window_days - 1 температур, поэтому новая порция обрабатывается за O(строк в порции).
+#
+#   stats = IncrementalCityStatistics()
+#   stats.update(history)          # первая загрузка — обычный проход по всем данным
+#   new_rows = stats.update(today)  # новые строки с rolling_mean, rolling_std, is_anomaly, trend
+#   stats.city_profiles(), stats.season_profiles()
+#
+# Новые наблюдения города должны идти по времени после уже загруженных.
+
+
+# Объединение (число, среднее, сумма квадратов отклонений) двух частей выборки — формула Чана.
+# Сумма произведений отклонений для двух величин объединяется так же, поэтому формула общая и для МНК
+def merge_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b, other_mean_a=None, other_mean_b=None):
+    count = count_a + count_b
+    share_b = np.divide(count_b, count, out=np.zeros(np.shape(count)), where=count > 0)
+    delta = mean_b - mean_a
+    delta_other = delta if other_mean_a is None else other_mean_b - other_mean_a
+
+    mean = mean_a + delta * share_b
+    m2 = m2_a + m2_b + delta * delta_other * count_a * share_b
+
+    return count, mean, m2
+
+
+# Среднее и сумма квадратов отклонений по группам (по codes) для новой порции
+def grouped_moments(codes, values, n_groups):
+    count = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    mean = np.divide(np.bincount(codes, weights=values, minlength=n_groups), count,
+                     out=np.zeros(n_groups), where=count > 0)
+    deviation = values - mean[codes]
+    m2 = np.bincount(codes, weights=deviation * deviation, minlength=n_groups)
+
+    return count, mean, m2, deviation
+
+
+class IncrementalCityStatistics:
+    """Статистики городов, которые обновляются порциями новых наблюдений"""
+
+    # count — число измеренных температур (по ним средние, min/max и МНК), obs_count — всех строк, как size в groupby
+    CITY_FIELDS = ("count", "obs_count", "mean", "m2", "min", "max", "anomalies", "x_mean", "sxx", "sxy")
+
+    def __init__(self, window_days=30):
+        # хвост города хранится как window_days - 1 последних значений, поэтому окно — только по числу строк
+        self.window_days = parse_window(window_days)
+        if isinstance(self.window_days, pd.Timedelta):
+            raise ValueError("Инкрементальный пересчет поддерживает только окно из числа наблюдений")
+        self.cities = []
+        self.city_codes = {}
+        self.city_state = {field: np.zeros(0) for field in self.CITY_FIELDS}
+        self.tails = []
+        # (код города, сезон) -> (число, среднее, сумма квадратов отклонений)
+        self.season_state = {}
+
+    def add_cities(self, cities):
+        new_cities = [city for city in cities if city not in self.city_codes]
+        for city in new_cities:
+            self.city_codes[city] = len(self.cities)
+            self.cities.append(city)
+            self.tails.append(np.zeros(0))
+
+        initial = {"min": np.inf, "max": -np.inf}
+        for field in self.CITY_FIELDS:
+            self.city_state[field] = np.concatenate(
+                (self.city_state[field], np.full(len(new_cities), initial.get(field, 0.0))))
+
+    def update(self, df):
+        """Добавляет порцию наблюдений и возвращает ее строки (сгруппированные по городам)
+        с rolling_mean, rolling_std, is_anomaly и trend по текущей прямой тренда"""
+        df, batch_codes, batch_cities, starts, counts = sort_by_city(df)
+        self.add_cities(batch_cities)
+        city_codes = np.array([self.city_codes[city] for city in batch_cities], dtype=np.int64)
+        codes = city_codes[batch_codes]
+
+        temperature = df["temperature"].to_numpy(dtype=np.float64)
+        x = timestamp_seconds(df["timestamp"])
+
+        # Скользящие статистики: перед новыми строками города ставим его хвост из прошлых порций
+        tails = [self.tails[code] for code in city_codes]
+        tail_counts = np.array([len(tail) for tail in tails], dtype=np.int64)
+        combined = np.concatenate([part for tail, start, count in zip(tails, starts, counts)
+                                   for part in (tail, temperature[start:start + count])])
+        combined_counts = tail_counts + counts
+        combined_starts = np.concatenate(([0], np.cumsum(combined_counts)[:-1]))
+        rolling_mean, rolling_std = grouped_rolling(combined, combined_starts, combined_counts, self.window_days)
+
+        is_new = np.arange(len(combined)) - np.repeat(combined_starts, combined_counts) \
+            >= np.repeat(tail_counts, combined_counts)
+        rolling_mean, rolling_std = rolling_mean[is_new], rolling_std[is_new]
+
+        keep = self.window_days - 1
+        for code, start, count in zip(city_codes, combined_starts, combined_counts):
+            self.tails[code] = combined[start + max(count - keep, 0):start + count].copy()
+
+        is_anomaly = anomaly_flags(temperature, rolling_mean, rolling_std)
+
+        self.update_city_state(codes, temperature, x, is_anomaly.to_numpy(dtype=np.float64, na_value=np.nan))
+        self.update_season_state(codes, df["season"].to_numpy(), temperature)
+
+        # та же компактная раскладка, что у city_statistics
+        df["rolling_mean"] = rolling_mean.astype(np.float32)
+        df["rolling_std"] = rolling_std.astype(np.float32)
+        df["is_anomaly"] = is_anomaly
+        df["trend"] = self.trend_values(codes, x).astype(np.float32)
+
+        return df
+
+    def update_city_state(self, codes, temperature, x, is_anomaly):
+        state = self.city_state
+        n_cities = len(self.cities)
+        state["obs_count"] += np.bincount(codes, minlength=n_cities)
+        state["anomalies"] += np.bincount(codes, weights=np.nan_to_num(is_anomaly), minlength=n_cities)
+
+        # пропуски температуры не входят в средние, min/max и накопители МНК, как в groupby и vectorized
+        valid = ~np.isnan(temperature)
+        codes, temperature, x = codes[valid], temperature[valid], x[valid]
+
+        count, mean, m2, y_deviation = grouped_moments(codes, temperature, n_cities)
+        _, x_mean, sxx, x_deviation = grouped_moments(codes, x, n_cities)
+        sxy = np.bincount(codes, weights=x_deviation * y_deviation, minlength=n_cities)
+
+        # Накопитель МНК для x·y объединяем до обновления средних
+        _, _, state["sxy"] = merge_moments(state["count"], state["x_mean"], state["sxy"],
+                                           count, x_mean, sxy, state["mean"], mean)
+        _, state["x_mean"], state["sxx"] = merge_moments(state["count"], state["x_mean"], state["sxx"],
+                                                         count, x_mean, sxx)
+        state["count"], state["mean"], state["m2"] = merge_moments(state["count"], state["mean"], state["m2"],
+                                                                   count, mean, m2)
+
+        np.minimum.at(state["min"], codes, temperature)
+        np.maximum.at(state["max"], codes, temperature)
+
+    def update_season_state(self, codes, seasons, temperature):
+        # Группа — пара (город, сезон), закодированная одним числом
+        season_codes, season_names = pd.factorize(seasons)
+        group_codes = codes * len(season_names) + season_codes
+        n_groups = len(self.cities) * len(season_names)
+        # группа есть в профиле и без измеренных температур (тогда среднее NaN), как в groupby
+        present = np.bincount(group_codes, minlength=n_groups) > 0
+        valid = ~np.isnan(temperature)
+        count, mean, m2, _ = grouped_moments(group_codes[valid], temperature[valid], n_groups)
+
+        for group in np.flatnonzero(present):
+            key = (int(group // len(season_names)), season_names[group % len(season_names)])
+            old_count, old_mean, old_m2 = self.season_state.get(key, (0.0, 0.0, 0.0))
+            self.season_state[key] = merge_moments(old_count, old_mean, old_m2,
+                                                   count[group], mean[group], m2[group])
+
+    def slope(self):
+        sxx, sxy = self.city_state["sxx"], self.city_state["sxy"]
+        # как в grouped_linear_trend: у города без измерений наклона нет
+        return np.divide(sxy, sxx, out=np.where(self.city_state["count"] > 0, 0.0, np.nan), where=sxx > 0)
+
+    def trend_values(self, codes, x):
+        """Значения текущей прямой тренда в точках x (codes — коды городов из city_codes)"""
+        state = self.city_state
+        return state["mean"][codes] + self.slope()[codes] * (x - state["x_mean"][codes])
+
+    def trend(self, df):
+        """Прямая тренда по всем накопленным данным для строк df — например, чтобы обновить столбец trend истории"""
+        codes = df["city"].map(self.city_codes).to_numpy(dtype=np.int64)
+        return self.trend_values(codes, timestamp_seconds(df["timestamp"]))
+
+    def city_profiles(self):
+        state = self.city_state
+        measured = state["count"] > 0
+        city_profile = pd.DataFrame({
+            "city": self.cities,
+            "temp_mean": np.where(measured, state["mean"], np.nan),
+            "temp_min": np.where(measured, state["min"], np.nan),
+            "temp_max": np.where(measured, state["max"], np.nan),
+            "anomalies_count": state["anomalies"],
+            "obs_count": state["obs_count"].astype(np.int64)
+        })
+
+        city_profile["anomalies_share"] = city_profile.anomalies_count / city_profile.obs_count
+        city_profile["trend"] = trend_label(self.slope())
+
+        return city_profile
+
+    def season_profiles(self):
+        # Города в порядке появления, сезоны внутри города по алфавиту — как в vectorized_city_statistics
+        keys = sorted(self.season_state)
+        count, mean, m2 = (np.array(values) for values in zip(*(self.season_state[key] for key in keys))) \
+            if keys else (np.zeros(0),) * 3
+
+        return pd.DataFrame({
+            "season": [season for _, season in keys],
+            "city": [self.cities[code] for code, _ in keys],
+            "temp_mean": np.where(count > 0, mean, np.nan),
+            "temp_std": np.sqrt(np.divide(m2, count - 1, out=np.full(len(keys), np.nan), where=count > 1))
+        })
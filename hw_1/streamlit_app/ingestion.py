@@ -0,0 +1,114 @@
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from processing import sort_by_city
+from profiling import timed_stage
+
+# Типы столбцов CSV: города и сезоны — категории, температура — float32
+CSV_DTYPES = {"city": "category", "season": "category", "temperature": "float32"}
+CHUNK_ROWS = 1_000_000
+COLUMNS = ("city", "timestamp", "temperature", "season")
+# Форматы выгрузок станций, которые читаются из папки или по glob
+SOURCE_EXTENSIONS = (".csv", ".parquet")
+
+
+# Разбор даты в чанке: один проход, повторяющиеся даты парсятся один раз (cache)
+def parse_chunk(chunk):
+    chunk["timestamp"] = pd.to_datetime(chunk["timestamp"], format="ISO8601", cache=True)
+    return chunk
+
+
+# Склейка чанков: категории объединяем, чтобы столбцы не превратились обратно в строки
+def concat_chunks(chunks):
+    if len(chunks) == 1:
+        return chunks[0]
+
+    columns = {}
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([chunk[column] for chunk in chunks])
+        else:
+            columns[column] = pd.concat([chunk[column] for chunk in chunks], ignore_index=True)
+
+    return pd.DataFrame(columns)
+
+
+# Индекс смещений: город -> (первая строка, строка после последней).
+# Строки каждого города идут подряд, поэтому срез города — это iloc[start:end] без фильтрации
+def build_city_offsets(df):
+    df, _, cities, starts, counts = sort_by_city(df)
+    offsets = {city: (int(start), int(start + count)) for city, start, count in zip(cities, starts, counts)}
+    return df, offsets
+
+
+# Чтение CSV с явными типами столбцов.
+# engine="c" — чтение чанками по chunksize строк, engine="pyarrow" — многопоточный разбор целиком
+def read_temperature_csv(file, chunksize=CHUNK_ROWS, engine="c"):
+    if engine == "pyarrow":
+        return parse_chunk(pd.read_csv(file, dtype=CSV_DTYPES, engine="pyarrow"))
+
+    chunks = [parse_chunk(chunk) for chunk in pd.read_csv(file, dtype=CSV_DTYPES, chunksize=chunksize)]
+    return concat_chunks(chunks)
+
+
+# Parquet-выгрузка: приводим столбцы к тем же типам, что у CSV
+def read_temperature_parquet(file):
+    df = pd.read_parquet(file, columns=list(COLUMNS)).astype(CSV_DTYPES)
+    if not pd.api.types.is_datetime64_any_dtype(df["timestamp"]):
+        df = parse_chunk(df)
+    return df.reset_index(drop=True)
+
+
+# Один файл выгрузки: формат по расширению имени (путь или загруженный файл с атрибутом name)
+def read_temperature_file(file, chunksize=CHUNK_ROWS, engine="c"):
+    name = str(getattr(file, "name", file))
+    if name.lower().endswith(".parquet"):
+        return read_temperature_parquet(file)
+    return read_temperature_csv(file, chunksize, engine)
+
+
+# Список файлов по путям, папкам и glob-шаблонам: из папок берем все CSV и Parquet
+def expand_sources(sources):
+    files = []
+    for source in sources:
+        if not isinstance(source, (str, os.PathLike)):
+            files.append(source)
+        elif os.path.isdir(source):
+            files.extend(sorted(path for path in glob.glob(os.path.join(source, "*"))
+                                if path.lower().endswith(SOURCE_EXTENSIONS)))
+        elif any(char in str(source) for char in "*?["):
+            files.extend(sorted(glob.glob(str(source), recursive=True)))
+        else:
+            files.append(source)
+
+    if not files:
+        raise FileNotFoundError(f"Не найдено файлов выгрузок: {list(sources)}")
+    return files
+
+
+# Параллельное чтение многих файлов пулом потоков: разбор CSV в pandas/pyarrow и чтение Parquet
+# отпускают GIL, а ожидание диска одного файла перекрывается разбором другого
+def read_temperature_files(sources, chunksize=CHUNK_ROWS, engine="c", max_workers=None):
+    files = expand_sources(sources)
+    if len(files) == 1:
+        return read_temperature_file(files[0], chunksize, engine)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(lambda file: read_temperature_file(file, chunksize, engine), files))
+    return concat_chunks(frames)
+
+
+# Загрузка CSV и индекс смещений городов
+@timed_stage()
+def load_temperature_data(file, chunksize=CHUNK_ROWS, engine="c"):
+    return build_city_offsets(read_temperature_csv(file, chunksize, engine))
+
+
+# Загрузка многих выгрузок станций (файлы, папки, glob; CSV и Parquet) в один датафрейм
+@timed_stage()
+def load_temperature_files(sources, chunksize=CHUNK_ROWS, engine="c", max_workers=None):
+    return build_city_offsets(read_temperature_files(sources, chunksize, engine, max_workers))
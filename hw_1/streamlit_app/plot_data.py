@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+# Подготовка данных для графиков на стороне сервера: в браузер уходит не больше max_points точек
+# на линию, а частотность температуры по месяцам считается заранее векторным бинированием.
+# Ширина графика Streamlit ~700 px, 2000 точек с запасом покрывают по точке на пиксель
+MAX_PLOT_POINTS = 2000
+
+month_order = ["January", "February", "March", "April", "May", "June",
+               "July", "August", "September", "October", "November", "December"]
+
+
+# Largest-Triangle-Three-Buckets: из каждого бакета берем точку, образующую наибольший треугольник
+# с выбранной точкой предыдущего бакета и средней точкой следующего. Первая и последняя точки сохраняются
+def lttb_indices(x, y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bounds = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+
+    # средние точки бакетов считаются заранее: следующий бакет для последнего — последняя точка
+    sums_x = np.add.reduceat(x[1:n - 1], bounds[:-1] - 1)
+    sums_y = np.add.reduceat(np.nan_to_num(y[1:n - 1]), bounds[:-1] - 1)
+    sizes = np.diff(bounds)
+    next_x = np.append(sums_x[1:] / sizes[1:], x[-1])
+    next_y = np.append(sums_y[1:] / sizes[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        area = np.abs((x[previous] - next_x[bucket]) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y[bucket] - y[previous]))
+        previous = start + np.nanargmax(area) if not np.all(np.isnan(area)) else start
+        selected[bucket + 1] = previous
+
+    return selected
+
+
+# Min/max-бакетирование: ряд режется на n_buckets бакетов подряд, в каждом оставляем минимум и максимум.
+# Бакеты одного размера, поэтому argmin/argmax считаются по строкам матрицы без сортировки
+def minmax_indices(y, n_buckets):
+    n = len(y)
+    if 2 * n_buckets >= n:
+        return np.arange(n)
+
+    bucket_size = -(-n // n_buckets)
+    y = np.asarray(y, dtype=np.float64)
+    # хвост последнего бакета и NaN заполняем так, чтобы они не выбирались
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(-1, bucket_size)
+
+    offsets = np.arange(len(padded)) * bucket_size
+    lowest = offsets + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    highest = offsets + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+
+    indices = np.unique(np.concatenate((lowest, highest)))
+    return indices[indices < n]
+
+
+# Прореженный ряд города для графика динамики: точки температуры — min/max по бакетам
+# плюс аномалии (все, если их не больше max_points), линии скользящего среднего и тренда — LTTB
+def downsample_city_series(df, max_points=MAX_PLOT_POINTS):
+    x = df["timestamp"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+
+    points = minmax_indices(df["temperature"].to_numpy(), max_points // 2)
+    anomalies = np.flatnonzero(df["is_anomaly"].to_numpy(dtype=np.float64, na_value=np.nan) == 1)
+    # аномалий тоже может быть слишком много — прореживаем их так же
+    anomalies = anomalies[minmax_indices(df["temperature"].to_numpy()[anomalies], max_points // 2)]
+    points = df.iloc[np.union1d(points, anomalies)]
+
+    lines = {column: df.iloc[lttb_indices(x, df[column].to_numpy(), max_points)][["timestamp", column]]
+             for column in ("rolling_mean", "trend")}
+
+    return points, lines
+
+
+# Частотность температуры по месяцам: число дней с каждой округленной температурой в каждом месяце.
+# Один bincount по коду (месяц, температура) вместо groupby по строковым названиям месяцев
+def month_temperature_histogram(df):
+    temperature = df["temperature"].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(temperature)
+    month = df["timestamp"].dt.month.to_numpy()[valid] - 1
+    temperature = np.round(temperature[valid]).astype(np.int64)
+    if len(temperature) == 0:
+        return pd.DataFrame({"month": pd.Categorical([], categories=month_order, ordered=True),
+                             "temperature": np.zeros(0), "days_count": np.zeros(0, dtype=np.int64)})
+
+    low = temperature.min()
+    n_temperatures = temperature.max() - low + 1
+    counts = np.bincount(month * n_temperatures + (temperature - low), minlength=12 * n_temperatures)
+    cells = np.flatnonzero(counts)
+
+    return pd.DataFrame({
+        "month": pd.Categorical.from_codes(cells // n_temperatures, categories=month_order, ordered=True),
+        "temperature": (cells % n_temperatures + low).astype(np.float64),
+        "days_count": counts[cells]
+    })
@@ -1,9 +1,17 @@
+import atexit
+import os
+import signal
+import threading
+from collections import deque
 import numpy as np
 import requests
 from datetime import datetime, timezone, timedelta
-from sklearn.linear_model import LinearRegression
+from multiprocessing import shared_memory
 from multiprocess.pool import Pool
 import pandas as pd
+from pandas.api.indexers import BaseIndexer
+from plot_data import month_order
+from profiling import timed, timed_stage
 
 # Для определения сезона даты, для которой делаем запрос по API
 month_to_season = {12: "winter", 1: "winter", 2: "winter",
@@ -19,72 +27,902 @@ weather_icons = {
     "Clouds": "☁️"}
 
 # Главная "тяжелая" функция запроса всей статистики по городу
-def city_statistics(df, window_days=30):
+# window_days — число наблюдений в окне или интервал времени ("30D", "720h"), см. parse_window
+# Этапы размечены для profiling.ProfileRun (вне замера разметка ничего не делает)
+def city_statistics(df, window_days=30, trend_method="ols"):
     # Определение аномалий по скользящим статистикам
-    df["rolling_mean"] = df.temperature.rolling(window=window_days).mean()
-    df["rolling_std"] = df.temperature.rolling(window=window_days).std()
+    x = timestamp_seconds(df["timestamp"])
+    y = df["temperature"].to_numpy(dtype=np.float64)
+    with timed("rolling"):
+        rolling_mean, rolling_std = grouped_rolling(y, np.array([0]), np.array([len(df)]), window_days, x)
 
-    df["is_anomaly"] = np.where(
-        df["rolling_mean"].notna() & df["rolling_std"].notna(),
-        (df["temperature"] < df["rolling_mean"] - 2 * df["rolling_std"]) |
-        (df["temperature"] > df["rolling_mean"] + 2 * df["rolling_std"]),
-        np.nan
-    )
+        is_anomaly = anomaly_flags(df["temperature"].to_numpy(), rolling_mean, rolling_std)
+        df["rolling_mean"] = rolling_mean.astype(np.float32)
+        df["rolling_std"] = rolling_std.astype(np.float32)
+        df["is_anomaly"] = is_anomaly
 
     # Общий профиль города
-    city_profile = df.groupby("city", as_index=False) \
-        .agg(temp_mean=("temperature", "mean"),
-             temp_min=("temperature", "min"),
-             temp_max=("temperature", "max"),
-             anomalies_count=("is_anomaly", "sum"),
-             obs_count=("timestamp", "size")
-             )
+    with timed("city_profile"):
+        city_profile = df.groupby("city", as_index=False, observed=True) \
+            .agg(temp_mean=("temperature", "mean"),
+                 temp_min=("temperature", "min"),
+                 temp_max=("temperature", "max"),
+                 anomalies_count=("is_anomaly", "sum"),
+                 obs_count=("timestamp", "size")
+                 )
 
-    city_profile["anomalies_share"] = city_profile.anomalies_count / city_profile.obs_count
+        city_profile["anomalies_count"] = city_profile.anomalies_count.astype(np.float64)
+        city_profile["anomalies_share"] = city_profile.anomalies_count / city_profile.obs_count
 
-    # + Тренд
-    df_temp = df.copy()
-    df_temp["timestamp_unix"] = df_temp["timestamp"].astype("int64") // 10 ** 9
+    # + Тренд (одна прямая по всем строкам df, без копии данных)
+    with timed("trend"):
+        slope, _, fitted = fit_trend(np.zeros(len(df), dtype=np.int64), x, y, 1, trend_method)
+
+        df["trend"] = fitted.astype(np.float32)
+        city_profile["trend"] = trend_label(slope)[0]
+
+    # Профиль сезона
+    # Оставляем город в groupby, чтобы можно было объединить выводы функции в один df
+    with timed("season_profile"):
+        season_profile = df.groupby(["season", "city"], as_index=False, observed=True).agg(
+            temp_mean=("temperature", "mean"),
+            temp_std=("temperature", "std")
+        )
+
+    return df, city_profile, season_profile
+
+# Флаг аномалии: значение вне rolling_mean ± 2·rolling_std. Хранится компактно как nullable Int8:
+# 1 — аномалия, 0 — норма, <NA> — окно еще не заполнено (скользящие статистики NaN).
+# Скользящие статистики и тренд в обогащенном датафрейме хранятся во float32
+def anomaly_flags(temperature, rolling_mean, rolling_std):
+    ready = ~np.isnan(rolling_mean) & ~np.isnan(rolling_std)
+    anomaly = (temperature < rolling_mean - 2 * rolling_std) | (temperature > rolling_mean + 2 * rolling_std)
+    return pd.arrays.IntegerArray(anomaly.astype(np.int8), ~ready)
+
+# Подписи флагов для графиков: "anomaly", "normal" или "undefined" (окно не заполнено)
+def anomaly_labels(is_anomaly):
+    flags = pd.Series(is_anomaly).to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.select([flags == 1, flags == 0], ["anomaly", "normal"], "undefined")
+
+# Распараллеливание главной функции обработки городов
+def parallel_city_statistics(df, num_processes=8, window_days=30, trend_method="ols"):
+    with timed("split_copy"):
+        groups_by_city = [df[df["city"] == city].copy().reset_index(drop=True) for city in df["city"].unique()]
+
+    with timed("pool"):
+        results = get_worker_pool(num_processes).starmap(
+            city_statistics, [(group, window_days, trend_method) for group in groups_by_city])
+
+    with timed("concat"):
+        df_result = pd.concat([result[0] for result in results], ignore_index=True)
+        city_profile_result = pd.concat([result[1] for result in results], ignore_index=True)
+        season_profile_result = pd.concat([result[2] for result in results], ignore_index=True)
+
+    return df_result, city_profile_result, season_profile_result
+
+# Последовательный цикл по городам, как в ноутбуке
+def serial_city_statistics(df, window_days=30, trend_method="ols"):
+    results = []
+    for city in df["city"].unique():
+        with timed("split_copy"):
+            group = df[df["city"] == city].copy().reset_index(drop=True)
+        with timed("city_statistics"):
+            results.append(city_statistics(group, window_days, trend_method))
+
+    with timed("concat"):
+        df_result = pd.concat([result[0] for result in results], ignore_index=True)
+        city_profile_result = pd.concat([result[1] for result in results], ignore_index=True)
+        season_profile_result = pd.concat([result[2] for result in results], ignore_index=True)
+
+    return df_result, city_profile_result, season_profile_result
+
+# Линейный тренд сразу для всех городов: МНК в замкнутой форме по группам
+# codes — номер города для каждого наблюдения (0..n_cities-1), x — время в секундах
+def grouped_linear_trend(codes, x, y, n_groups=None):
+    # пропуски y не участвуют в подгонке (нулевой вес), но прямая считается и в их точках
+    valid = ~np.isnan(y)
+    weights = valid.astype(np.float64)
+    y = np.where(valid, y, 0.0)
+
+    counts = np.bincount(codes, weights=weights, minlength=n_groups or 0)
+    x_mean = np.divide(np.bincount(codes, weights=x * weights, minlength=len(counts)), counts,
+                       out=np.full(len(counts), np.nan), where=counts > 0)
+    y_mean = np.divide(np.bincount(codes, weights=y, minlength=len(counts)), counts,
+                       out=np.full(len(counts), np.nan), where=counts > 0)
 
-    X = df_temp["timestamp_unix"].values.reshape(-1, 1)
-    y = df_temp["temperature"].values
+    # Центрируем x внутри группы, чтобы не терять точность на больших unix-временах
+    dx = x - x_mean[codes]
+    sxx = np.bincount(codes, weights=np.where(valid, dx * dx, 0.0), minlength=len(counts))
+    sxy = np.bincount(codes, weights=np.where(valid, dx * (y - y_mean[codes]), 0.0), minlength=len(counts))
 
-    model = LinearRegression()
-    model.fit(X, y)
+    # у группы без измерений наклона нет (NaN), у группы из одной точки он нулевой
+    slope = np.divide(sxy, sxx, out=np.where(counts > 0, 0.0, np.nan), where=sxx > 0)
+    intercept = y_mean - slope * x_mean
+    fitted = y_mean[codes] + slope[codes] * dx
 
-    df["trend"] = model.predict(X)
-    slope = model.coef_[0]
+    return slope, intercept, fitted
 
-    if abs(slope) < 1e-9:
-        trend = "doesn`t exist"
-    elif slope < 0:
-        trend = "negative"
+# Робастный тренд Тейла–Сена по группам: медиана наклонов по случайной выборке пар точек
+# (полный перебор пар квадратичен по числу наблюдений), свободный член — медиана остатков
+def grouped_theil_sen_trend(codes, x, y, n_groups=None, pairs_per_group=20000, seed=0):
+    counts = np.bincount(codes, minlength=n_groups or 0)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    order = np.argsort(codes, kind="stable")
+    rng = np.random.default_rng(seed)
+
+    pair_codes = np.repeat(np.arange(len(counts)), pairs_per_group)
+    pair_counts = counts[pair_codes]
+    i = order[starts[pair_codes] + rng.integers(0, np.maximum(pair_counts, 1))]
+    j = order[starts[pair_codes] + rng.integers(0, np.maximum(pair_counts, 1))]
+
+    valid = (pair_counts > 0) & (x[i] != x[j]) & ~np.isnan(y[i]) & ~np.isnan(y[j])
+    pair_slopes = (y[j[valid]] - y[i[valid]]) / (x[j[valid]] - x[i[valid]])
+    slope = np.nan_to_num(grouped_median(pair_codes[valid], pair_slopes, len(counts)))
+
+    # пропуски y не участвуют в оценке; у группы без измерений наклона нет
+    measured = ~np.isnan(y)
+    slope[np.bincount(codes[measured], minlength=len(counts)) == 0] = np.nan
+    intercept = grouped_median(codes[measured], (y - slope[codes] * x)[measured], len(counts))
+    fitted = intercept[codes] + slope[codes] * x
+
+    return slope, intercept, fitted
+
+# Медиана значений по группам за одну сортировку
+def grouped_median(codes, values, n_groups):
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sorted_values = values[np.lexsort((values, codes))]
+
+    median = np.full(n_groups, np.nan)
+    has_values = counts > 0
+    lower = sorted_values[(starts + (counts - 1) // 2)[has_values]]
+    upper = sorted_values[(starts + counts // 2)[has_values]]
+    median[has_values] = (lower + upper) / 2
+
+    return median
+
+# Тренд по группам выбранным методом: "ols" (МНК) или "theil_sen"
+def fit_trend(codes, x, y, n_groups=None, method="ols"):
+    if method == "ols":
+        return grouped_linear_trend(codes, x, y, n_groups)
+    if method == "theil_sen":
+        return grouped_theil_sen_trend(codes, x, y, n_groups)
+    raise ValueError(f"Неизвестный метод тренда: {method}")
+
+# Время наблюдений в секундах unix
+def timestamp_seconds(timestamp):
+    return timestamp.to_numpy(dtype="datetime64[s]").astype(np.int64).astype(np.float64)
+
+# Характер тренда по наклону
+def trend_label(slope):
+    return np.select([np.isnan(slope), np.abs(slope) < 1e-9, slope < 0],
+                     ["undefined", "doesn`t exist", "negative"], "positive")
+
+# Строки каждого города подряд (порядок внутри города сохраняется) и границы городов
+def sort_by_city(df):
+    codes, cities = pd.factorize(df["city"])
+
+    if np.any(np.diff(codes) < 0):
+        order = np.argsort(codes, kind="stable")
+        df = df.iloc[order].reset_index(drop=True)
+        codes = codes[order]
     else:
-        trend = "positive"
+        df = df.reset_index(drop=True)
 
-    city_profile["trend"] = trend
+    counts = np.bincount(codes, minlength=len(cities))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
 
-    # Профиль сезона
-    # Оставляем город в groupby, чтобы можно было объединить выводы функции в один df
-    season_profile = df.groupby(["season", "city"], as_index=False).agg(
-        temp_mean=("temperature", "mean"),
-        temp_std=("temperature", "std")
-    )
+    return df, codes, cities, starts, counts
+
+# Окно скользящих статистик: целое число — окно из стольких наблюдений (строк) города,
+# строка или Timedelta ("30D", "720h") — интервал времени (t - window, t] по меткам наблюдений.
+# Окно по числу строк означает "30 дней" только для ежедневных данных без пропусков,
+# временное окно подходит и для почасовых, нерегулярных и смешанных по частоте рядов
+def parse_window(window):
+    if isinstance(window, str) and window.isdigit():
+        window = int(window)
+    if isinstance(window, (int, np.integer)):
+        if window < 1:
+            raise ValueError(f"Окно должно быть положительным: {window}")
+        return int(window)
+
+    try:
+        window = pd.Timedelta(window)
+    except ValueError as e:
+        raise ValueError(f"Некорректное окно скользящих статистик: {window!r}") from e
+    if window <= pd.Timedelta(0):
+        raise ValueError(f"Окно должно быть положительным: {window}")
+    return window
+
+# Скользящие среднее и std по городам, идущим подряд: считаем по всему массиву,
+# а окна, захватившие предыдущий город (первые window_days - 1 строк города), зануляем.
+# Для временного окна нужны timestamps — время наблюдений в секундах (timestamp_seconds)
+def grouped_rolling(values, starts, counts, window_days, timestamps=None):
+    window_days = parse_window(window_days)
+    if isinstance(window_days, pd.Timedelta):
+        if timestamps is None:
+            raise ValueError("Для временного окна нужно время наблюдений")
+        return grouped_time_rolling(values, timestamps, starts, counts, window_days)
+
+    rolling = pd.Series(values).rolling(window=window_days)
+    rolling_mean = rolling.mean().to_numpy()
+    rolling_std = rolling.std().to_numpy()
+
+    position = np.arange(len(values)) - np.repeat(starts, counts)
+    incomplete = position < window_days - 1
+    rolling_mean[incomplete] = np.nan
+    rolling_std[incomplete] = np.nan
+
+    return rolling_mean, rolling_std
+
+# Окна переменной длины для rolling: строки [window_starts[i], i], границы считаются заранее
+class WindowBoundsIndexer(BaseIndexer):
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        return self.window_starts, np.arange(1, num_values + 1, dtype=np.int64)
+
+# Скользящие статистики во временном окне (t - window, t] по городам, идущим подряд.
+# Начало окна каждой строки ищется бинарным поиском по времени внутри города, поэтому окна не
+# захватывают соседний город и не требуют ресемплинга; сами среднее и std считает rolling pandas
+# за один проход по всему массиву с переменными окнами.
+# Пропуски и разная частота: окно города считается заполненным, когда история города покрывает
+# весь интервал (с точностью до типичного шага — медианы интервалов между наблюдениями города),
+# и в окне не меньше min_periods наблюдений — по умолчанию половина ожидаемого при типичном шаге.
+# Для ежедневного ряда без пропусков окно "30D" дает то же, что окно из 30 строк.
+# Строки города могут идти не по времени: статистики считаются в порядке времени и возвращаются
+# в исходном порядке строк
+def grouped_time_rolling(values, timestamps, starts, counts, window, min_periods=None):
+    window_seconds = window.total_seconds()
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    order = None
+    window_starts = np.empty(len(values), dtype=np.int64)
+    ready = np.empty(len(values), dtype=bool)
+    required = np.empty(len(values), dtype=np.int64)
+    for start, count in zip(starts, counts):
+        rows = slice(start, start + count)
+        t = timestamps[rows]
+        steps = np.diff(t)
+        if np.any(steps < 0):
+            if order is None:
+                order = np.arange(len(values))
+            city_order = np.argsort(t, kind="stable")
+            order[rows] = start + city_order
+            t = t[city_order]
+            steps = np.diff(t)
+
+        window_starts[rows] = start + np.searchsorted(t, t - window_seconds, side="right")
+        positive_steps = steps[steps > 0]
+        step = np.median(positive_steps) if len(positive_steps) else window_seconds
+        ready[rows] = t - t[0] >= window_seconds - step
+        required[rows] = max(2, int(np.ceil(window_seconds / step / 2))) if min_periods is None else min_periods
+
+    if order is not None:
+        values = values[order]
+
+    rolling = pd.Series(values).rolling(WindowBoundsIndexer(window_starts=window_starts), min_periods=1)
+    rolling_mean = rolling.mean().to_numpy()
+    rolling_std = rolling.std().to_numpy()
+
+    # число наблюдений с температурой в окне
+    observed = np.concatenate(([0], np.cumsum(~np.isnan(values))))
+    window_counts = observed[1:] - observed[window_starts]
+    incomplete = ~ready | (window_counts < required)
+    rolling_mean[incomplete] = np.nan
+    rolling_std[incomplete] = np.nan
+
+    if order is not None:
+        rolling_mean[order], rolling_std[order] = rolling_mean.copy(), rolling_std.copy()
+
+    return rolling_mean, rolling_std
+
+# Аномалии и профили городов и сезонов по уже посчитанным скользящим статистикам и тренду
+@timed_stage("assemble")
+def assemble_city_statistics(df, codes, cities, rolling_mean, rolling_std, fitted, slope):
+    with timed("anomalies"):
+        is_anomaly = anomaly_flags(df["temperature"].to_numpy(), rolling_mean, rolling_std)
+        df["rolling_mean"] = rolling_mean.astype(np.float32)
+        df["rolling_std"] = rolling_std.astype(np.float32)
+        df["is_anomaly"] = is_anomaly
+
+    # Общий профиль города
+    with timed("city_profile"):
+        city_profile = df.groupby("city", as_index=False, sort=False, observed=True) \
+            .agg(temp_mean=("temperature", "mean"),
+                 temp_min=("temperature", "min"),
+                 temp_max=("temperature", "max"),
+                 anomalies_count=("is_anomaly", "sum"),
+                 obs_count=("timestamp", "size")
+                 )
+
+        city_profile["anomalies_count"] = city_profile.anomalies_count.astype(np.float64)
+        city_profile["anomalies_share"] = city_profile.anomalies_count / city_profile.obs_count
+
+    # + Тренд
+    df["trend"] = fitted.astype(np.float32)
+    city_profile["trend"] = trend_label(slope)
+
+    with timed("season_profile"):
+        season_profile = season_statistics(df, codes, cities)
 
     return df, city_profile, season_profile
 
-# Распараллеливание главной функции обработки городов
-def parallel_city_statistics(df, num_processes=8):
-    groups_by_city = [df[df["city"] == city].copy().reset_index(drop=True) for city in df["city"].unique()]
+# Профиль сезона без скользящих статистик: среднее и std температуры по (город, сезон).
+# Города в порядке появления, сезоны внутри города по алфавиту
+def season_statistics(df, codes=None, cities=None):
+    if codes is None:
+        codes, cities = pd.factorize(df["city"])
 
-    with Pool(processes=num_processes) as pool:
-        results = pool.map(city_statistics, groups_by_city)
+    season_stats = df["temperature"].groupby([codes, df["season"]], observed=True).agg(["mean", "std"])
+    return pd.DataFrame({
+        "season": season_stats.index.get_level_values(1),
+        "city": cities[season_stats.index.get_level_values(0)],
+        "temp_mean": season_stats["mean"].to_numpy(),
+        "temp_std": season_stats["std"].to_numpy()
+    })
 
-    df_result = pd.concat([result[0] for result in results], ignore_index=True)
-    city_profile_result = pd.concat([result[1] for result in results], ignore_index=True)
-    season_profile_result = pd.concat([result[2] for result in results], ignore_index=True)
+# Векторизованный расчет статистик по всем городам за один сгруппированный проход:
+# без копии данных на каждый город и без пула процессов.
+# Результат совпадает с parallel_city_statistics (тот же порядок городов и строк)
+def vectorized_city_statistics(df, window_days=30, trend_method="ols"):
+    with timed("sort_by_city"):
+        df, codes, cities, starts, counts = sort_by_city(df)
 
-    return df_result, city_profile_result, season_profile_result
+    temperature = df["temperature"].to_numpy(dtype=np.float64)
+    x = timestamp_seconds(df["timestamp"])
+    with timed("rolling"):
+        rolling_mean, rolling_std = grouped_rolling(temperature, starts, counts, window_days, x)
+    with timed("trend"):
+        slope, _, fitted = fit_trend(codes, x, temperature, len(cities), trend_method)
+
+    return assemble_city_statistics(df, codes, cities, rolling_mean, rolling_std, fitted, slope)
+
+# Сезонная модель города: уровень + линейный тренд + гармоники годового цикла по дню года
+#   temperature ≈ level + trend_per_year·(t - time_center) + Σ_k (sin_k·sin(kφ) + cos_k·cos(kφ)),
+# φ — доля тропического года от 1 января (2π·день года / 365.2425). Модели всех городов оцениваются
+# одним МНК по группам, без объектов модели на город; остатки дают аномалии, модель — прогноз
+YEAR_SECONDS = 365.2425 * 86400
+SEASONAL_HARMONICS = 3
+
+# Признаки сезонной модели: столбцы 1, время в годах от центра ряда города, sin/cos гармоник.
+# Матрица по столбцам (order="F"), гармоники k > 1 — по формулам сложения из первой (два вызова sin/cos)
+def seasonal_design(x, x_center, n_harmonics=SEASONAL_HARMONICS):
+    design = np.empty((len(x), 2 + 2 * n_harmonics), order="F")
+    design[:, 0] = 1.0
+    design[:, 1] = (x - x_center) / YEAR_SECONDS
+
+    phase = 2 * np.pi * x / YEAR_SECONDS
+    sin_1, cos_1 = np.sin(phase), np.cos(phase)
+    sin_k, cos_k = sin_1, cos_1
+    for k in range(1, n_harmonics + 1):
+        if k > 1:
+            sin_k, cos_k = sin_k * cos_1 + cos_k * sin_1, cos_k * cos_1 - sin_k * sin_1
+        design[:, 2 * k], design[:, 2 * k + 1] = sin_k, cos_k
+    return design
+
+# МНК сразу для всех городов (строки города подряд с starts): нормальные уравнения X'X·β = X'y
+# собираются суммами по отрезкам городов (np.add.reduceat, по паре столбцов, без матрицы n × p × p)
+# и решаются одним пакетным псевдообращением (города × p × p).
+# weights — 0/1 для строк, не участвующих в оценке (пропуски температуры); y без NaN
+def grouped_least_squares(design, y, starts, weights=None):
+    n_columns = design.shape[1]
+    gram = np.empty((len(starts), n_columns, n_columns))
+    moments = np.empty((len(starts), n_columns))
+    for i in range(n_columns):
+        weighted_column = design[:, i] if weights is None else design[:, i] * weights
+        moments[:, i] = np.add.reduceat(weighted_column * y, starts)
+        for j in range(i, n_columns):
+            gram[:, i, j] = gram[:, j, i] = np.add.reduceat(weighted_column * design[:, j], starts)
+
+    # псевдообратная, а не solve: у городов с коротким рядом (меньше года) матрица вырождена
+    return (np.linalg.pinv(gram) @ moments[:, :, None])[:, :, 0]
+
+# Последнее время и типичный шаг (медиана интервалов) ряда каждого города; строки города подряд
+def city_time_grid(codes, x, starts):
+    same_city = codes[1:] == codes[:-1]
+    if np.any(np.diff(x)[same_city] < 0):
+        x = x[np.lexsort((x, codes))]
+
+    last = np.maximum.reduceat(x, starts)
+    step = grouped_median(codes[1:][same_city], np.diff(x)[same_city], len(starts))
+    return last, step
+
+# Оценка сезонных моделей всех городов (строки города подряд, как после sort_by_city): коэффициенты
+# (города × p), центр времени, подогнанные значения по строкам, сезонная часть и std остатков
+# (NaN, если наблюдений не больше числа параметров)
+def fit_seasonal_baseline(codes, x, y, starts, n_harmonics=SEASONAL_HARMONICS):
+    n_groups = len(starts)
+    valid = ~np.isnan(y)
+    weights = None if valid.all() else valid.astype(np.float64)
+    y = np.where(valid, y, 0.0)
+
+    counts = np.add.reduceat(valid.astype(np.float64), starts)
+    x_sum = np.add.reduceat(x if weights is None else x * weights, starts)
+    x_center = np.divide(x_sum, counts, out=np.zeros(n_groups), where=counts > 0)
+
+    design = seasonal_design(x, x_center[codes], n_harmonics)
+    coef = grouped_least_squares(design, y, starts, weights)
+
+    seasonal = np.zeros(len(x))
+    for i in range(2, design.shape[1]):
+        seasonal += design[:, i] * coef[codes, i]
+    fitted = coef[codes, 0] + coef[codes, 1] * design[:, 1] + seasonal
+
+    residual = np.where(valid, y - fitted, np.nan)
+    dof = counts - design.shape[1]
+    residual_ss = np.add.reduceat(np.nan_to_num(residual) ** 2, starts)
+    residual_std = np.sqrt(np.divide(residual_ss, dof, out=np.full(n_groups, np.nan), where=dof > 0))
+
+    return {"coef": coef, "x_center": x_center, "counts": counts, "fitted": fitted, "seasonal": seasonal,
+            "residual": residual, "residual_std": residual_std}
+
+# Сезонная декомпозиция всех городов: к наблюдениям добавляются baseline (уровень + тренд + сезон),
+# seasonal (сезонная часть), residual и is_seasonal_anomaly — остаток вне ±2·std остатков города
+# (nullable Int8, как is_anomaly). Вторым значением — модели городов для seasonal_forecast:
+# коэффициенты, амплитуда годового цикла, самый теплый и холодный день года, последнее время и шаг ряда
+# Строки городов идут подряд, как в vectorized_city_statistics
+@timed_stage()
+def seasonal_decomposition(df, n_harmonics=SEASONAL_HARMONICS):
+    if df.empty:
+        raise ValueError("Нет наблюдений для сезонной модели")
+    with timed("sort_by_city"):
+        df, codes, cities, starts, counts = sort_by_city(df)
+    x = timestamp_seconds(df["timestamp"])
+    temperature = df["temperature"].to_numpy(dtype=np.float64)
+
+    with timed("fit"):
+        model = fit_seasonal_baseline(codes, x, temperature, starts, n_harmonics)
+
+    df["baseline"] = model["fitted"].astype(np.float32)
+    df["seasonal"] = model["seasonal"].astype(np.float32)
+    df["residual"] = model["residual"].astype(np.float32)
+    # пропуск температуры — <NA>, а не норма
+    df["is_seasonal_anomaly"] = anomaly_flags(temperature,
+                                              np.where(np.isnan(model["residual"]), np.nan, model["fitted"]),
+                                              model["residual_std"][codes])
+
+    # годовой цикл на сетке дней года: одна матрица (города × 366)
+    days = np.arange(366) * 86400.0
+    season_curve = model["coef"][:, 2:] @ seasonal_design(days, 0.0, n_harmonics)[:, 2:].T
+    last, step = city_time_grid(codes, x, starts)
+
+    models = pd.DataFrame({"city": cities, "obs_count": model["counts"].astype(np.int64),
+                           "level": model["coef"][:, 0], "trend_per_year": model["coef"][:, 1]})
+    for k in range(1, n_harmonics + 1):
+        models[f"sin_{k}"] = model["coef"][:, 2 * k]
+        models[f"cos_{k}"] = model["coef"][:, 2 * k + 1]
+    models["residual_std"] = model["residual_std"]
+    models["amplitude"] = (season_curve.max(axis=1) - season_curve.min(axis=1)) / 2
+    models["warmest_day"] = season_curve.argmax(axis=1) + 1
+    models["coldest_day"] = season_curve.argmin(axis=1) + 1
+    models["time_center"] = pd.to_datetime(model["x_center"], unit="s")
+    models["last_timestamp"] = pd.to_datetime(last, unit="s")
+    models["step"] = pd.to_timedelta(step, unit="s")
+
+    return df, models
+
+# Прогноз на horizon шагов ряда вперед (шаг — типичный интервал наблюдений города) по моделям
+# seasonal_decomposition: одна матрица признаков на все города и шаги, интервал — ±2·std остатков
+def seasonal_forecast(models, horizon=7):
+    n_harmonics = sum(column.startswith("sin_") for column in models.columns)
+    coef_columns = ["level", "trend_per_year"] + [f"{kind}_{k}" for k in range(1, n_harmonics + 1)
+                                                  for kind in ("sin", "cos")]
+    coef = models[coef_columns].to_numpy(dtype=np.float64)
+
+    steps = np.arange(1, horizon + 1)
+    codes = np.repeat(np.arange(len(models)), horizon)
+    last = timestamp_seconds(models["last_timestamp"])
+    step = models["step"].dt.total_seconds().to_numpy()
+    x = last[codes] + step[codes] * np.tile(steps, len(models))
+
+    design = seasonal_design(x, timestamp_seconds(models["time_center"])[codes], n_harmonics)
+    forecast = np.einsum("ij,ij->i", design, coef[codes])
+    spread = 2 * models["residual_std"].to_numpy(dtype=np.float64)[codes]
+
+    return pd.DataFrame({
+        "city": models["city"].to_numpy()[codes],
+        "timestamp": pd.to_datetime(x, unit="s"),
+        "horizon": np.tile(steps, len(models)),
+        "forecast": forecast,
+        "lower": forecast - spread,
+        "upper": forecast + spread
+    })
+
+# Постоянный пул процессов: создается один раз и переиспользуется между вызовами.
+# Сессии Streamlit работают в разных потоках, поэтому замена пула — под блокировкой
+worker_pool = None
+worker_pool_size = None
+worker_pool_lock = threading.Lock()
+
+# Ctrl+C обрабатывает родительский процесс (отмена расчета), воркеры его игнорируют,
+# иначе прерванная задача не вернет результат и ожидание пула зависнет
+def ignore_interrupt():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def get_worker_pool(num_processes):
+    global worker_pool, worker_pool_size
+
+    with worker_pool_lock:
+        if worker_pool is None or worker_pool_size != num_processes:
+            if worker_pool is not None:
+                worker_pool.terminate()
+            worker_pool = Pool(processes=num_processes, initializer=ignore_interrupt)
+            worker_pool_size = num_processes
+
+        return worker_pool
+
+# При выходе завершаем текущий пул (один обработчик на все пересоздания пула)
+@atexit.register
+def terminate_worker_pool():
+    with worker_pool_lock:
+        if worker_pool is not None:
+            worker_pool.terminate()
+
+# Делим города на чанки с примерно равным числом строк; город целиком попадает в один чанк
+def city_chunks(counts, n_chunks):
+    row_ends = np.cumsum(counts)
+    row_starts = row_ends - counts
+    targets = row_ends[-1] * np.arange(1, n_chunks) / n_chunks
+
+    # Граница чанка — ближайшая к целевой строке граница города
+    containing = np.searchsorted(row_ends, targets, side="right")
+    bounds = np.where(targets - row_starts[containing] < row_ends[containing] - targets,
+                      containing, containing + 1)
+    bounds = np.unique(bounds[(bounds > 0) & (bounds < len(counts))])
+    bounds = np.concatenate(([0], bounds, [len(counts)]))
+
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+# Воркер shared-memory бэкенда: читает свой срез массивов без копирования
+# и пишет результаты на те же позиции в общие выходные массивы
+def shared_chunk_statistics(task):
+    blocks = {key: shared_memory.SharedMemory(name=name) for key, (name, _, _) in task["blocks"].items()}
+    try:
+        compute_shared_chunk(blocks, task)
+    finally:
+        for block in blocks.values():
+            block.close()
+
+def compute_shared_chunk(blocks, task):
+    arrays = {key: np.ndarray((length,), dtype=dtype, buffer=blocks[key].buf)
+              for key, (_, length, dtype) in task["blocks"].items()}
+    city_start, city_end = task["cities"]
+    rows = slice(task["rows"][0], task["rows"][1])
+
+    codes = arrays["codes"][rows] - city_start
+    counts = np.bincount(codes, minlength=city_end - city_start)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    temperature = arrays["temperature"][rows]
+
+    timestamp = arrays["timestamp"][rows]
+    rolling_mean, rolling_std = grouped_rolling(temperature, starts, counts, task["window_days"], timestamp)
+    slope, _, fitted = fit_trend(codes, timestamp, temperature, city_end - city_start, task["trend_method"])
+
+    arrays["rolling_mean"][rows] = rolling_mean
+    arrays["rolling_std"][rows] = rolling_std
+    arrays["trend"][rows] = fitted
+    arrays["slope"][city_start:city_end] = slope
+
+# Входные столбцы в shared memory (копируются один раз) и выходные массивы float64 под результаты воркеров.
+# Возвращает блоки (закрыть и удалить — release_shared_blocks) и их описания для задач воркеров
+def create_shared_blocks(inputs, outputs):
+    blocks = {}
+    try:
+        for key, values in inputs.items():
+            blocks[key] = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=blocks[key].buf)[:] = values
+        for key, length in outputs.items():
+            blocks[key] = shared_memory.SharedMemory(create=True, size=max(length * 8, 1))
+    except BaseException:
+        release_shared_blocks(blocks)
+        raise
+
+    block_specs = {key: (blocks[key].name, len(values), values.dtype.str) for key, values in inputs.items()}
+    block_specs.update({key: (blocks[key].name, length, "<f8") for key, length in outputs.items()})
+    return blocks, block_specs
+
+def release_shared_blocks(blocks):
+    for block in blocks.values():
+        block.close()
+        block.unlink()
+
+# Столбцы отсортированного по городам df для воркеров и размеры выходных массивов
+def shared_city_arrays(df, codes, n_cities):
+    inputs = {
+        "codes": codes.astype(np.int64),
+        "temperature": df["temperature"].to_numpy(dtype=np.float64),
+        "timestamp": timestamp_seconds(df["timestamp"])
+    }
+    outputs = {"rolling_mean": len(df), "rolling_std": len(df), "trend": len(df), "slope": n_cities}
+    return inputs, outputs
+
+def shared_chunk_task(block_specs, row_bounds, city_start, city_end, window_days, trend_method):
+    return {"blocks": block_specs,
+            "cities": (int(city_start), int(city_end)),
+            "rows": (int(row_bounds[city_start]), int(row_bounds[city_end])),
+            "window_days": window_days,
+            "trend_method": trend_method}
+
+# Параллельный расчет для больших данных: столбцы лежат в shared memory,
+# воркеры постоянного пула обрабатывают чанки городов по смещениям без пиклинга датафреймов
+def shared_memory_city_statistics(df, window_days=30, trend_method="ols", num_processes=None):
+    num_processes = num_processes or os.cpu_count() or 1
+    if df.empty:
+        return vectorized_city_statistics(df, window_days, trend_method)
+
+    with timed("sort_by_city"):
+        df, codes, cities, starts, counts = sort_by_city(df)
+    inputs, outputs = shared_city_arrays(df, codes, len(cities))
+
+    with timed("shared_memory_copy"):
+        blocks, block_specs = create_shared_blocks(inputs, outputs)
+    try:
+        row_bounds = np.concatenate((starts, [len(df)]))
+        tasks = [shared_chunk_task(block_specs, row_bounds, city_start, city_end, window_days, trend_method)
+                 for city_start, city_end in city_chunks(counts, min(num_processes * 4, len(cities)))]
+
+        with timed("pool"):
+            get_worker_pool(num_processes).map(shared_chunk_statistics, tasks)
+
+        results = {key: np.ndarray((length,), dtype=np.float64, buffer=blocks[key].buf).copy()
+                   for key, length in outputs.items()}
+    finally:
+        release_shared_blocks(blocks)
+
+    return assemble_city_statistics(df, codes, cities, results["rolling_mean"], results["rolling_std"],
+                                    results["trend"], results["slope"])
+
+# Выбор бэкенда: на небольших данных процессы не окупаются, считаем векторизованно
+PARALLEL_MIN_ROWS = 2_000_000
+BACKENDS = ("auto", "serial", "process_pool", "vectorized", "shared_memory")
+
+# Задачи по одной в этом процессе (num_processes=1) или в постоянном пуле, где в работе не больше
+# двух задач на процесс. Результаты отдаются в порядке задач по мере готовности.
+# cancel — объект с is_set() (например, threading.Event): после отмены новые задачи не запускаются,
+# а уже запущенные в пуле дорабатывают, но их результаты не ждем
+def run_tasks(function, tasks, num_processes=1, cancel=None):
+    cancelled = lambda: cancel is not None and cancel.is_set()
+
+    if num_processes == 1:
+        for task in tasks:
+            if cancelled():
+                return
+            yield function(*task)
+        return
+
+    pool = get_worker_pool(num_processes)
+    pending = deque()
+    for task in tasks:
+        if cancelled():
+            return
+        pending.append(pool.apply_async(function, task))
+        if len(pending) >= 2 * num_processes:
+            yield pending.popleft().get()
+
+    while pending and not cancelled():
+        yield pending.popleft().get()
+
+# Расчет по чанкам из целых городов (~chunk_rows строк) с отдачей результатов по мере готовности:
+#   for done_rows, total_rows, (data, city_profile, season_profile) in iter_city_statistics(df): ...
+# Чанк считается vectorized_city_statistics в этом процессе или воркером пула по столбцам в shared memory
+# (как shared_memory_city_statistics), поэтому результаты чанков вместе совпадают с ними.
+# Процессов по умолчанию — как у compute_city_statistics(backend="auto"): пул только на больших данных
+PROGRESS_CHUNK_ROWS = 500_000
+
+def iter_city_statistics(df, window_days=30, trend_method="ols", chunk_rows=PROGRESS_CHUNK_ROWS,
+                         num_processes=None, cancel=None):
+    if num_processes is None:
+        num_processes = (os.cpu_count() or 1) if len(df) >= PARALLEL_MIN_ROWS else 1
+    df, codes, cities, starts, counts = sort_by_city(df)
+    if df.empty:
+        return
+
+    row_bounds = np.concatenate((starts, [len(df)]))
+    n_chunks = min(-(-len(df) // chunk_rows), len(cities))
+    chunks = city_chunks(counts, n_chunks)
+
+    if num_processes == 1:
+        tasks = ((df.iloc[row_bounds[city_start]:row_bounds[city_end]].copy(), window_days, trend_method)
+                 for city_start, city_end in chunks)
+        results = run_tasks(vectorized_city_statistics, tasks, num_processes, cancel)
+        for (city_start, city_end), result in zip(chunks, results):
+            yield int(row_bounds[city_end]), len(df), result
+        return
+
+    # В пул уходят только имена блоков shared memory и границы чанка, а не копии строк
+    inputs, outputs = shared_city_arrays(df, codes, len(cities))
+    blocks, block_specs = create_shared_blocks(inputs, outputs)
+    try:
+        tasks = ((shared_chunk_task(block_specs, row_bounds, city_start, city_end, window_days, trend_method),)
+                 for city_start, city_end in chunks)
+        results = {key: np.ndarray((length,), dtype=np.float64, buffer=blocks[key].buf)
+                   for key, length in outputs.items()}
+
+        for (city_start, city_end), _ in zip(chunks, run_tasks(shared_chunk_statistics, tasks, num_processes, cancel)):
+            rows = slice(int(row_bounds[city_start]), int(row_bounds[city_end]))
+            chunk = {key: results[key][rows].copy() for key in ("rolling_mean", "rolling_std", "trend")}
+            result = assemble_city_statistics(df.iloc[rows].reset_index(drop=True), codes[rows] - city_start,
+                                              cities[city_start:city_end], chunk["rolling_mean"],
+                                              chunk["rolling_std"], chunk["trend"],
+                                              results["slope"][city_start:city_end].copy())
+            yield rows.stop, len(df), result
+    finally:
+        release_shared_blocks(blocks)
+
+# Пустые результаты: нет данных или расчет отменен до первого готового чанка
+def empty_city_statistics(data=None):
+    return (pd.DataFrame() if data is None else data,
+            pd.DataFrame(columns=["city", "temp_mean", "temp_min", "temp_max", "anomalies_count", "obs_count",
+                                  "anomalies_share", "trend"]),
+            pd.DataFrame(columns=["season", "city", "temp_mean", "temp_std"]))
+
+# Расчет с прогрессом и отменой: progress(done_rows, total_rows, результат чанка) вызывается после
+# каждого чанка (например, чтобы показать готовые города), после отмены возвращаются уже посчитанные города
+def progressive_city_statistics(df, window_days=30, trend_method="ols", progress=None, cancel=None,
+                                num_processes=None):
+    results = []
+    for done_rows, total_rows, result in iter_city_statistics(df, window_days, trend_method,
+                                                              num_processes=num_processes, cancel=cancel):
+        results.append(result)
+        if progress is not None:
+            progress(done_rows, total_rows, result)
+
+    if not results:
+        return empty_city_statistics(df.iloc[:0].copy())
+    return tuple(pd.concat([result[i] for result in results], ignore_index=True) for i in range(3))
+
+# progress и cancel переключают расчет на чанки из целых городов (progressive_city_statistics):
+# "serial" и "vectorized" считают чанки в этом процессе, остальные бэкенды — в пуле
+@timed_stage()
+def compute_city_statistics(df, window_days=30, trend_method="ols", backend="auto", progress=None, cancel=None):
+    if progress is not None or cancel is not None:
+        num_processes = 1 if backend in ("serial", "vectorized") else None
+        if backend in ("process_pool", "shared_memory"):
+            num_processes = os.cpu_count() or 1
+        return progressive_city_statistics(df, window_days, trend_method, progress, cancel, num_processes)
+
+    if backend == "auto":
+        use_parallel = len(df) >= PARALLEL_MIN_ROWS and (os.cpu_count() or 1) > 1
+        backend = "shared_memory" if use_parallel else "vectorized"
+
+    if backend == "serial":
+        return serial_city_statistics(df, window_days, trend_method)
+    if backend == "process_pool":
+        return parallel_city_statistics(df, window_days=window_days, trend_method=trend_method)
+    if backend == "vectorized":
+        return vectorized_city_statistics(df, window_days, trend_method)
+    if backend == "shared_memory":
+        return shared_memory_city_statistics(df, window_days, trend_method)
+    raise ValueError(f"Неизвестный бэкенд: {backend}")
+
+# Куб предагрегатов для дашборда: город × год × месяц × сезон с count/sum/sumsq/min/max
+# и гистограмма температуры. Строится один раз на город (app.py) или датасет, после чего таблицы
+# и графики app.py отвечают по срезу города в кубе, не просматривая наблюдения.
+#   cells         — (город, год, месяц, сезон): count, sum, sumsq, min, max
+#   histogram     — (город, год, месяц, округленная температура): число дней (полярная диаграмма)
+#   season_values — температуры, отсортированные по (город, сезон, температура): точные квартили
+#                   describe, усы и выбросы боксплота
+# Таблицы — словари numpy-массивов, отсортированные по городу; bounds — границы строк каждого города
+@timed_stage()
+def build_aggregation_cube(df):
+    codes, cities = pd.factorize(df["city"])
+    season_codes, seasons = pd.factorize(df["season"], sort=True)
+    raw_temperature = df["temperature"].to_numpy()
+    temperature = raw_temperature.astype(np.float64)
+    valid = ~np.isnan(temperature)
+    timestamp = df["timestamp"][valid]
+
+    keys = {"city": codes[valid], "year": timestamp.dt.year.to_numpy(), "month": timestamp.dt.month.to_numpy(),
+            "season": season_codes[valid]}
+    temperature = temperature[valid]
+
+    cells = pd.DataFrame({**keys, "temperature": temperature, "squared": temperature ** 2}) \
+        .groupby(list(keys)) \
+        .agg(count=("temperature", "size"), sum=("temperature", "sum"), sumsq=("squared", "sum"),
+             min=("temperature", "min"), max=("temperature", "max")) \
+        .reset_index()
+
+    histogram = pd.DataFrame({"city": keys["city"], "year": keys["year"], "month": keys["month"],
+                              "temperature": np.round(temperature)}) \
+        .groupby(["city", "year", "month", "temperature"]).size().rename("count").reset_index()
+
+    # в исходном типе температуры, чтобы квартили совпадали с describe() по столбцу
+    season_temperature = raw_temperature[valid]
+    order = np.lexsort((season_temperature, keys["season"], keys["city"]))
+    season_values = {"city": keys["city"][order], "season": keys["season"][order],
+                     "temperature": season_temperature[order]}
+
+    cube = {"cities": list(cities), "city_codes": {city: i for i, city in enumerate(cities)},
+            "seasons": np.asarray(seasons), "bounds": {}}
+    for name, table in (("cells", cells), ("histogram", histogram), ("season_values", season_values)):
+        cube[name] = {column: np.asarray(table[column]) for column in table}
+        cube["bounds"][name] = np.searchsorted(cube[name]["city"], np.arange(len(cities) + 1))
+
+    return cube
+
+# Строки таблицы куба для одного города (срез массивов без копирования)
+def cube_slice(cube, table, city):
+    code = cube["city_codes"][city]
+    start, end = cube["bounds"][table][code:code + 2]
+    return {column: values[start:end] for column, values in cube[table].items()}
+
+# Годы с наблюдениями города
+def cube_years(cube, city):
+    return np.unique(cube_slice(cube, "cells", city)["year"]).tolist()
+
+# Частотность температуры по месяцам за выбранные годы — в формате plot_data.month_temperature_histogram
+def cube_month_histogram(cube, city, years=None):
+    histogram = cube_slice(cube, "histogram", city)
+    selected = np.isin(histogram["year"], years) if years is not None else slice(None)
+
+    month = histogram["month"][selected] - 1
+    temperature = histogram["temperature"][selected]
+    # сумма по годам: одна ячейка на пару (месяц, температура)
+    cell_keys, cell_codes = np.unique(np.stack((month, temperature)), axis=1, return_inverse=True)
+    days_count = np.bincount(cell_codes.ravel(), weights=histogram["count"][selected],
+                             minlength=cell_keys.shape[1]).astype(np.int64)
+
+    return pd.DataFrame({
+        "month": pd.Categorical.from_codes(cell_keys[0].astype(np.int64), categories=month_order, ordered=True),
+        "temperature": cell_keys[1],
+        "days_count": days_count
+    })
+
+# Отсортированные температуры города по сезонам: код сезона -> массив (срез без копирования)
+def cube_season_values(cube, city):
+    values = cube_slice(cube, "season_values", city)
+    bounds = np.searchsorted(values["season"], np.arange(len(cube["seasons"]) + 1))
+    return {season: values["temperature"][bounds[season]:bounds[season + 1]]
+            for season in range(len(cube["seasons"])) if bounds[season + 1] > bounds[season]}
+
+# Описательные статистики температуры города по сезонам — как groupby(["city", "season"]).describe():
+# count, mean, std, min, max по ячейкам куба, квартили — по отсортированным значениям сезона
+def cube_describe(cube, city):
+    cells = cube_slice(cube, "cells", city)
+    season_values = cube_season_values(cube, city)
+    n_seasons = len(cube["seasons"])
+
+    count = np.bincount(cells["season"], weights=cells["count"], minlength=n_seasons)
+    total = np.bincount(cells["season"], weights=cells["sum"], minlength=n_seasons)
+    total_squares = np.bincount(cells["season"], weights=cells["sumsq"], minlength=n_seasons)
+    present = np.flatnonzero(count)
+
+    rows = []
+    for season in present:
+        season_cells = cells["season"] == season
+        n = count[season]
+        variance = (total_squares[season] - total[season] ** 2 / n) / (n - 1) if n > 1 else np.nan
+        # линейная интерполяция между порядковыми статистиками, как в pandas
+        q1, median, q3 = np.quantile(season_values[season], [0.25, 0.5, 0.75])
+        rows.append([n, total[season] / n, np.sqrt(max(variance, 0)) if n > 1 else np.nan,
+                     cells["min"][season_cells].min(), q1, median, q3, cells["max"][season_cells].max()])
+
+    index = pd.MultiIndex.from_arrays([[city] * len(present), cube["seasons"][present]], names=["city", "season"])
+    columns = pd.MultiIndex.from_product([["temperature"], ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]])
+    return pd.DataFrame(rows, index=index, columns=columns)
+
+# Статистики боксплота по сезонам: квартили, усы до крайних значений в пределах 1.5 IQR
+# и выбросы за усами — то, что рисует px.box
+def cube_box(cube, city):
+    season_values = cube_season_values(cube, city)
+    describe = cube_describe(cube, city)["temperature"]
+
+    season_codes = {season: code for code, season in enumerate(cube["seasons"])}
+    seasons = describe.index.get_level_values("season")
+    q1, q3 = describe["25%"].to_numpy(), describe["75%"].to_numpy()
+    iqr = q3 - q1
+
+    lower_fences, upper_fences, outliers = [], [], []
+    for i, season in enumerate(seasons):
+        values = season_values[season_codes[season]]
+        inside = (values >= q1[i] - 1.5 * iqr[i]) & (values <= q3[i] + 1.5 * iqr[i])
+        lower_fences.append(values[inside].min())
+        upper_fences.append(values[inside].max())
+        outliers.append(values[~inside])
+
+    return pd.DataFrame({"season": seasons, "q1": q1, "median": describe["50%"].to_numpy(), "q3": q3,
+                         "mean": describe["mean"].to_numpy(),
+                         "lowerfence": lower_fences, "upperfence": upper_fences, "outliers": outliers})
 
 # Сезон для даты запроса температуры по API
 def get_season(unix_timestamp, timezone_offset):
@@ -95,8 +933,38 @@ def get_season(unix_timestamp, timezone_offset):
 
     return season
 
+# Разбор ответа API текущей погоды: температура, сезон и иконка или описание ошибки
+def parse_weather(data):
+    if (
+            "main" not in data or
+            "temp" not in data["main"] or
+            "dt" not in data or
+            "timezone" not in data or
+            "weather" not in data or
+            "main" not in data["weather"][0]
+    ):
+        return {"error": "Некорректный формат данных от API"}
+
+    temperature = data["main"]["temp"]
+    unix_timestamp = data["dt"]
+    timezone = data["timezone"]
+    season = get_season(unix_timestamp, timezone)
+    weather = data["weather"][0]["main"]
+    weather_icon = weather_icons.get(weather, "")
+
+    return {"temperature": temperature, "season": season, "weather_icon": weather_icon}
+
+# Ошибка API по HTTP-статусу
+def http_error(status, e):
+    if status == 401:
+        return {"error": "Некорректный API-ключ"}
+    elif status == 404:
+        return {"error": "Город не найден"}
+    else:
+        return {"error": f"HTTP ошибка: {e}"}
+
 # Функция запроса в API
-# Запрос делаем для одного города, не используем асинхронность
+# Запрос делаем для одного города, не используем асинхронность (для всех городов — weather_client)
 def get_response(city, key):
     url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={key}&units=metric"
     try:
@@ -108,46 +976,54 @@ def get_response(city, key):
         except ValueError:
             return {"error": "Некорректный формат ответа от API"}
 
-        if (
-                "main" not in data or
-                "temp" not in data["main"] or
-                "dt" not in data or
-                "timezone" not in data or
-                "weather" not in data or
-                "main" not in data["weather"][0]
-        ):
-            return {"error": "Некорректный формат данных от API"}
-
-        temperature = data["main"]["temp"]
-        unix_timestamp = data["dt"]
-        timezone = data["timezone"]
-        season = get_season(unix_timestamp, timezone)
-        weather = data["weather"][0]["main"]
-        weather_icon = weather_icons.get(weather, "")
-
-        return {"temperature": temperature, "season": season, "weather_icon": weather_icon}
+        return parse_weather(data)
 
     except requests.exceptions.HTTPError as e:
-        if response.status_code == 401:
-            return {"error": "Некорректный API-ключ"}
-        elif response.status_code == 404:
-            return {"error": "Город не найден"}
-        else:
-            return {"error": f"HTTP ошибка: {e}"}
+        return http_error(response.status_code, e)
 
     except Exception as e:
         return {"error": f"Ошибка: {e}"}
 
+# Индекс профиля сезона: (город, сезон) -> (среднее, std). Вместе со словарем хранит ключи
+# в MultiIndex и массивы средних и std, чтобы is_anomaly_batch только искал позиции
+class SeasonIndex(dict):
+    def __init__(self, cities, seasons, mean, std):
+        super().__init__(zip(zip(cities, seasons), zip(mean, std)))
+        self.keys_index = pd.MultiIndex.from_arrays([np.asarray(cities), np.asarray(seasons)],
+                                                    names=["city", "season"])
+        self.mean = mean
+        self.std = std
+
+# Индекс строится один раз после расчета профилей
+@timed_stage()
+def build_season_index(season_profile):
+    return SeasonIndex(season_profile["city"].to_numpy(), season_profile["season"].to_numpy(),
+                       season_profile["temp_mean"].to_numpy(dtype=np.float64),
+                       season_profile["temp_std"].to_numpy(dtype=np.float64))
+
 # Является ли значение аномальным для сезона
+# season_profile — датафрейм профиля сезона или готовый индекс из build_season_index
 def is_anomaly(city, season, current_temp, season_profile):
-    city_season_profile = season_profile[
-        (season_profile["city"] == city) & (season_profile["season"] == season)] \
-        .copy().reset_index(drop=True)
+    season_index = season_profile if isinstance(season_profile, dict) else build_season_index(season_profile)
+
+    if (city, season) not in season_index:
+        raise ValueError(f"Данные {city}-{season} отсутствуют")
+
+    mean, std = season_index[(city, season)]
+
+    return bool(current_temp < mean - 2 * std or current_temp > mean + 2 * std)
+
+# Проверка массива текущих температур за один вызов: города, сезоны и температуры — массивы одной длины
+# season_index — индекс из build_season_index
+def is_anomaly_batch(cities, seasons, temperatures, season_index):
+    positions = season_index.keys_index.get_indexer(pd.MultiIndex.from_arrays([np.asarray(cities), np.asarray(seasons)]))
 
-    if city_season_profile.empty:
+    if np.any(positions < 0):
+        missing = positions < 0
+        city, season = np.asarray(cities)[missing][0], np.asarray(seasons)[missing][0]
         raise ValueError(f"Данные {city}-{season} отсутствуют")
 
-    mean = city_season_profile["temp_mean"].values[0]
-    std = city_season_profile["temp_std"].values[0]
+    mean, std = season_index.mean[positions], season_index.std[positions]
+    temperatures = np.asarray(temperatures, dtype=np.float64)
 
-    return bool(current_temp < mean - 2 * std or current_temp > mean + 2 * std)
\ No newline at end of file
+    return (temperatures < mean - 2 * std) | (temperatures > mean + 2 * std)
@@ -0,0 +1,170 @@
+import cProfile
+import contextvars
+import functools
+import math
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# resource есть только на Unix; на Windows память берется из psutil, если он установлен
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Инструментирование этапов расчета: время и изменение памяти каждого этапа внутри активного замера.
+#   with ProfileRun() as run:            # или run = ProfileRun().start() ... run.stop()
+#       compute_city_statistics(df)
+#   run.summary()                        # этапы: число вызовов, время, изменение RSS
+# Этапы размечаются в коде через with timed("rolling") или декоратор @timed_stage(); вложенные этапы
+# получают составные имена ("compute_city_statistics/vectorized/rolling"). Без активного замера разметка
+# ничего не делает, поэтому остается в коде постоянно. Замер виден в своем потоке; этапы внутри
+# процессов пула не попадают в замер — их время входит в этап, который ждет пул.
+# profile_path дополнительно включает профилировщик на время замера: *.prof — cProfile
+# (pstats, snakeviz), *.html — pyinstrument, если он установлен
+
+current_run = contextvars.ContextVar("current_run", default=None)
+current_stage = contextvars.ContextVar("current_stage", default="")
+
+
+# Пиковый RSS процесса в MB (ru_maxrss в килобайтах на Linux и в байтах на macOS);
+# без resource — пиковый рабочий набор из psutil, без обоих — NaN
+def peak_rss_mb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, "peak_wset", memory.rss) / 2 ** 20
+    return math.nan
+
+
+# Текущий RSS процесса в MB: из /proc на Linux, иначе из psutil, если его нет — пиковый
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        if psutil is not None:
+            return psutil.Process().memory_info().rss / 2 ** 20
+        return peak_rss_mb()
+
+
+@contextmanager
+def timed(name):
+    run = current_run.get()
+    if run is None:
+        yield
+        return
+
+    parent = current_stage.get()
+    stage = f"{parent}/{name}" if parent else name
+    token = current_stage.set(stage)
+    # порядок этапов в сводке — порядок их первого запуска
+    run.stages.setdefault(stage, (0, 0.0, 0.0))
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.record(stage, time.perf_counter() - start, rss_mb() - rss_before)
+        current_stage.reset(token)
+
+
+# Декоратор: вызов функции — этап с именем name (по умолчанию имя функции)
+def timed_stage(name=None):
+    def decorator(function):
+        stage = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def start_profiler(path):
+    if path.endswith(".html"):
+        try:
+            from pyinstrument import Profiler
+        except ImportError as e:
+            raise ImportError("Для отчета *.html нужен pyinstrument: pip install pyinstrument") from e
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler, path):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(path)
+        return
+
+    profiler.stop()
+    with open(path, "w") as f:
+        f.write(profiler.output_html())
+
+
+class ProfileRun:
+    """Замер одного прогона: этапы, выполненные внутри него, общее время и память"""
+
+    def __init__(self, profile_path=None):
+        self.profile_path = profile_path
+        # этап -> (число вызовов, секунды, изменение RSS в MB)
+        self.stages = {}
+        self.elapsed = None
+        self.rss_start = None
+        self.rss_end = None
+        self.profiler = None
+        self.token = None
+
+    def start(self):
+        self.rss_start = rss_mb()
+        if self.profile_path:
+            self.profiler = start_profiler(self.profile_path)
+        self.token = current_run.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        if self.profiler is not None:
+            stop_profiler(self.profiler, self.profile_path)
+            self.profiler = None
+        self.rss_end = rss_mb()
+        current_run.reset(self.token)
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record(self, stage, seconds, rss_delta):
+        calls, total, memory = self.stages.get(stage, (0, 0.0, 0.0))
+        self.stages[stage] = (calls + 1, total + seconds, memory + rss_delta)
+
+    def summary(self):
+        """Этапы в порядке первого запуска: вызовы, время и изменение RSS за все вызовы"""
+        return pd.DataFrame([(stage, calls, seconds, memory) for stage, (calls, seconds, memory) in self.stages.items()],
+                            columns=["stage", "calls", "seconds", "rss_delta_mb"])
+
+    def memory(self):
+        """RSS в начале и в конце замера и пиковый RSS процесса, MB"""
+        return {"rss_start_mb": self.rss_start, "rss_end_mb": self.rss_end, "peak_rss_mb": peak_rss_mb()}
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+
+import pyarrow as pa
+from pyarrow import feather
+
+# Дисковый кэш результатов compute_city_statistics: ключ — хэш содержимого файла (content_hash) и параметров расчета.
+# Результаты лежат в несжатом Arrow IPC (Feather v2) и читаются через memory map
+CACHE_DIR = os.environ.get("TEMPERATURE_CACHE_DIR",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+CACHE_MAX_BYTES = int(os.environ.get("TEMPERATURE_CACHE_MAX_BYTES", 2 * 2 ** 30))
+# Меняется при изменении формата результатов, чтобы не читать устаревшие записи
+CACHE_VERSION = "2"
+RESULT_NAMES = ("data", "city_profiles", "season_profiles")
+
+
+# Хэш содержимого загруженного файла — идентификатор датасета
+def content_hash(content):
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+# Ключ кэша: датасет + параметры, влияющие на результат
+def statistics_cache_key(dataset_key, **params):
+    digest = hashlib.blake2b(dataset_key.encode(), digest_size=16)
+    digest.update(repr((CACHE_VERSION, sorted(params.items()))).encode())
+    return digest.hexdigest()
+
+
+def load_cached_statistics(key, cache_dir=CACHE_DIR):
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        return None
+
+    try:
+        results = tuple(feather.read_table(os.path.join(entry_dir, f"{name}.arrow"), memory_map=True).to_pandas()
+                        for name in RESULT_NAMES)
+    except (OSError, pa.ArrowInvalid):
+        # недописанная или поврежденная запись — считаем заново
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+    # время последнего использования для вытеснения
+    os.utime(entry_dir)
+    return results
+
+
+# Запись сначала во временную папку, затем атомарное переименование
+def save_cached_statistics(key, results, cache_dir=CACHE_DIR):
+    entry_dir = os.path.join(cache_dir, key)
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    try:
+        for name, df in zip(RESULT_NAMES, results):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            feather.write_feather(table, os.path.join(tmp_dir, f"{name}.arrow"), compression="uncompressed")
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # запись уже сделал другой процесс
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    evict_cache(cache_dir)
+
+
+def entry_size(entry_dir):
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+# Удаляем давно не использованные записи, пока кэш больше max_bytes
+def evict_cache(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    entries = [entry for entry in os.scandir(cache_dir) if entry.is_dir() and ".tmp-" not in entry.name]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+
+    sizes = [entry_size(entry.path) for entry in entries]
+    total = sum(sizes)
+    for entry, size in zip(entries, sizes):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry.path, ignore_errors=True)
+        total -= size
+
+
+# Результаты из кэша или расчет compute(df, **params) с сохранением в кэш
+def cached_city_statistics(dataset_key, df, compute, cache_dir=CACHE_DIR, **params):
+    key = statistics_cache_key(dataset_key, **params)
+    results = load_cached_statistics(key, cache_dir)
+    if results is not None:
+        return results
+
+    results = compute(df, **params)
+    # пустые результаты (ошибка в данных) не кэшируем
+    if not any(result.empty for result in results):
+        save_cached_statistics(key, results, cache_dir)
+    return results
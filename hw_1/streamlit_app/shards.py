@@ -0,0 +1,112 @@
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from ingestion import CHUNK_ROWS, CSV_DTYPES, build_city_offsets, concat_chunks, expand_sources, read_temperature_file
+from processing import empty_city_statistics, run_tasks, vectorized_city_statistics
+
+# Шардированное хранилище наблюдений: папка на город, в ней по Parquet-файлу на каждую исходную выгрузку
+#   shard_dir/<город>/part-00000.parquet
+# Выгрузки станций раскладываются по шардам параллельно и по одной, без сборки всех данных в памяти.
+# Город целиком лежит в одном шарде, поэтому статистики по шардам считаются независимо:
+#   shard_temperature_files(["exports/*.csv"], "shards/")
+#   data, city_profiles, season_profiles = sharded_city_statistics("shards/")
+
+
+# Запись датафрейма по шардам городов; part_name различает части от разных выгрузок
+def write_city_shards(df, shard_dir, part_name="part-00000"):
+    df, offsets = build_city_offsets(df)
+    for city, (start, end) in offsets.items():
+        city_dir = os.path.join(shard_dir, quote(str(city), safe=" #"))
+        os.makedirs(city_dir, exist_ok=True)
+        city_df = df.iloc[start:end]
+        city_df = city_df.assign(city=city_df["city"].cat.remove_unused_categories())
+        city_df.to_parquet(os.path.join(city_dir, f"{part_name}.parquet"), engine="pyarrow", index=False)
+
+
+# Раскладка многих выгрузок (файлы, папки, glob; CSV и Parquet) по шардам пулом потоков:
+# каждый поток читает свою выгрузку и пишет ее части в папки городов
+def shard_temperature_files(sources, shard_dir, chunksize=CHUNK_ROWS, engine="c", max_workers=None):
+    if os.path.isdir(shard_dir) and os.listdir(shard_dir):
+        raise FileExistsError(f"Папка шардов не пуста: {shard_dir}")
+    files = expand_sources(sources)
+
+    def shard_file(index, file):
+        write_city_shards(read_temperature_file(file, chunksize, engine), shard_dir, f"part-{index:05d}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(shard_file, range(len(files)), files))
+
+    return list_city_shards(shard_dir)
+
+
+# Шарды городов и число строк в каждом (из метаданных Parquet, без чтения данных)
+def list_city_shards(shard_dir):
+    shards = []
+    for path in sorted(glob.glob(os.path.join(shard_dir, "*"))):
+        parts = glob.glob(os.path.join(path, "*.parquet"))
+        if parts:
+            shards.append((path, sum(pq.ParquetFile(part).metadata.num_rows for part in parts)))
+    return shards
+
+
+# Наблюдения группы шардов одним чтением Parquet (многопоточным в pyarrow); строки города — по времени
+def read_city_shards(paths):
+    parts = [part for path in paths for part in sorted(glob.glob(os.path.join(path, "*.parquet")))]
+    df = pq.read_table(parts).to_pandas().astype(CSV_DTYPES)
+    # город собран из нескольких выгрузок — части могут идти не по времени
+    if len(parts) > len(paths):
+        df = df.sort_values(["city", "timestamp"], kind="stable").reset_index(drop=True)
+    return df
+
+
+# Шарды по задачам с близким числом строк: от больших шардов к меньшим, каждый — в наименее
+# загруженную задачу. Задачи возвращаются от крупных к мелким, чтобы длинные начинались первыми
+def balance_shards(shard_rows, n_tasks):
+    loads = np.zeros(n_tasks)
+    tasks = [[] for _ in range(n_tasks)]
+    for shard in np.argsort(-np.asarray(shard_rows), kind="stable"):
+        task = int(np.argmin(loads))
+        tasks[task].append(int(shard))
+        loads[task] += shard_rows[shard]
+
+    order = np.argsort(-loads, kind="stable")
+    return [sorted(tasks[task]) for task in order if tasks[task]]
+
+
+# Воркер: статистики городов своей группы шардов
+def shard_statistics(paths, window_days=30, trend_method="ols"):
+    return vectorized_city_statistics(read_city_shards(paths), window_days, trend_method)
+
+
+# Статистики по шардированному хранилищу. Процессов — по числу ядер (не больше числа шардов),
+# шарды делятся на задачи по числу строк, а не поровну по числу городов; пул раздает задачи
+# по мере освобождения процессов. progress(done_rows, total_rows, результат задачи) вызывается
+# после каждой задачи, после cancel.is_set() возвращаются уже посчитанные города
+def sharded_city_statistics(shard_dir, window_days=30, trend_method="ols", num_processes=None,
+                            progress=None, cancel=None):
+    shards = list_city_shards(shard_dir)
+    if not shards:
+        raise FileNotFoundError(f"В папке нет шардов: {shard_dir}")
+
+    paths, rows = zip(*shards)
+    num_processes = min(num_processes or os.cpu_count() or 1, len(shards))
+    groups = balance_shards(rows, min(num_processes * 4, len(shards)))
+    tasks = [([paths[shard] for shard in group], window_days, trend_method) for group in groups]
+
+    results = []
+    done_rows = 0
+    for group, result in zip(groups, run_tasks(shard_statistics, tasks, num_processes, cancel)):
+        results.append(result)
+        done_rows += sum(rows[shard] for shard in group)
+        if progress is not None:
+            progress(done_rows, sum(rows), result)
+
+    if not results:
+        return empty_city_statistics()
+    data, city_profiles, season_profiles = (concat_chunks([result[i] for result in results]) for i in range(3))
+    return data, city_profiles, season_profiles
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+# Потоковый детектор аномалий: каждое новое показание города оценивается за O(1) по времени и памяти.
+# Состояние каждого потока (города) — кольцевой буфер из window последних значений и накопители Уэлфорда
+# (среднее и сумма квадратов отклонений окна), поэтому в режиме "rolling" флаги совпадают со столбцом
+# is_anomaly из city_statistics: значение вне rolling_mean ± 2·rolling_std, окно включает текущее значение,
+# пока в окне меньше window значений — NaN. Пропуски (NaN) считаются в окне, как в pandas rolling:
+# пока пропуск в окне, флаг NaN, а когда он выходит из окна, статистики окна пересчитываются точно.
+#
+# Варианты:
+#   method="rolling"  — скользящие среднее и std (Уэлфорд с удалением выпавшего из окна значения);
+#   method="mad"      — скользящие медиана и MAD (робастно к выбросам в окне), O(window) на точку;
+#   method="seasonal" — базовая линия сезона города по всей истории до текущего показания,
+#                       как профиль сезона в is_anomaly, но без заглядывания вперед.
+#
+# Все потоки обрабатываются векторно: в score(streams, values) порция раскладывается на раунды —
+# в раунде r берется r-е значение каждого потока, поэтому порядок внутри потока сохраняется.
+
+# Масштаб MAD к std для нормального распределения
+MAD_SCALE = 1.4826
+
+
+class StreamingAnomalyDetector:
+    """Потоковые флаги аномалий для n_streams независимых рядов (например, городов)"""
+
+    def __init__(self, n_streams, window=30, n_sigmas=2, method="rolling", n_seasons=4, min_season_count=30):
+        if method not in ("rolling", "mad", "seasonal"):
+            raise ValueError(f"Неизвестный метод детектора: {method}")
+
+        self.window = window
+        self.n_sigmas = n_sigmas
+        self.method = method
+        self.min_season_count = min_season_count
+
+        self.buffer = np.zeros((n_streams, window))
+        self.position = np.zeros(n_streams, dtype=np.int64)
+        self.count = np.zeros(n_streams, dtype=np.int64)
+        self.mean = np.zeros(n_streams)
+        self.m2 = np.zeros(n_streams)
+        # число пропусков (NaN) в окне потока
+        self.nan_count = np.zeros(n_streams, dtype=np.int64)
+        # базовые линии сезонов: (поток, сезон) -> число, среднее, сумма квадратов отклонений
+        self.season_count = np.zeros((n_streams, n_seasons))
+        self.season_mean = np.zeros((n_streams, n_seasons))
+        self.season_m2 = np.zeros((n_streams, n_seasons))
+
+    def score(self, streams, values, seasons=None):
+        """Флаги для порции показаний: 1.0 — аномалия, 0.0 — норма, NaN — не хватает истории.
+        streams — номера потоков, seasons — номера сезонов (нужны для method="seasonal")"""
+        streams = np.asarray(streams, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        seasons = None if seasons is None else np.asarray(seasons, dtype=np.int64)
+        flags = np.full(len(values), np.nan)
+        if len(values) == 0:
+            return flags
+
+        # номер показания внутри своего потока в этой порции
+        order = np.argsort(streams, kind="stable")
+        sorted_streams = streams[order]
+        first = np.r_[True, sorted_streams[1:] != sorted_streams[:-1]]
+        group_start = np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+        rounds = np.empty(len(order), dtype=np.int64)
+        rounds[order] = np.arange(len(order)) - group_start
+
+        round_order = np.argsort(rounds, kind="stable")
+        round_bounds = np.searchsorted(rounds[round_order], np.arange(rounds.max() + 2))
+        for start, end in zip(round_bounds[:-1], round_bounds[1:]):
+            rows = round_order[start:end]
+            flags[rows] = self.step(streams[rows], values[rows], None if seasons is None else seasons[rows])
+
+        return flags
+
+    def step(self, streams, values, seasons=None):
+        """Одно новое показание для каждого из потоков streams (без повторов)"""
+        if self.method == "seasonal":
+            return self.step_seasonal(streams, values, seasons)
+
+        window = self.window
+        full = self.count[streams] >= window
+        old = self.buffer[streams, self.position[streams]]
+        self.buffer[streams, self.position[streams]] = values
+        self.position[streams] = (self.position[streams] + 1) % window
+        self.count[streams] += 1
+
+        nan_before = self.nan_count[streams]
+        nan_after = nan_before + np.isnan(values) - (full & np.isnan(old))
+        self.nan_count[streams] = nan_after
+
+        if self.method == "mad":
+            return self.flags_mad(streams, values)
+
+        # Уэлфорд: в неполное окно значение добавляется, в полном — заменяет выпавшее.
+        # Пока в окне есть пропуск, накопители не обновляются (флаг все равно NaN)
+        clean = (nan_before == 0) & (nan_after == 0)
+        clean_streams, new, old, full = streams[clean], values[clean], old[clean], full[clean]
+        mean, m2 = self.mean[clean_streams], self.m2[clean_streams]
+        count = np.minimum(self.count[clean_streams], window)
+        delta = np.where(full, new - old, new - mean)
+        new_mean = mean + delta / count
+        m2 = m2 + np.where(full, delta * (new - new_mean + old - mean), delta * (new - new_mean))
+        self.mean[clean_streams], self.m2[clean_streams] = new_mean, m2
+
+        # последний пропуск вышел из окна — пересчитываем окно точно; так же раз в window шагов,
+        # чтобы ошибки округления не накапливались
+        periodic = (self.position[streams] == 0) & (self.count[streams] >= window) & (nan_after == 0)
+        refresh = streams[periodic | ((nan_before > 0) & (nan_after == 0))]
+        if len(refresh):
+            # в неполном окне заполнены первые count ячеек буфера
+            filled = np.arange(window) < np.minimum(self.count[refresh], window)[:, None]
+            self.mean[refresh] = (self.buffer[refresh] * filled).sum(axis=1) / filled.sum(axis=1)
+            self.m2[refresh] = (((self.buffer[refresh] - self.mean[refresh, None]) * filled) ** 2).sum(axis=1)
+
+        ready = (self.count[streams] >= window) & (nan_after == 0)
+        std = np.sqrt(np.maximum(self.m2[streams], 0) / (window - 1)) if window > 1 else np.full(len(streams), np.nan)
+        return self.flags(values, self.mean[streams], std, ready)
+
+    def flags_mad(self, streams, values):
+        ready = (self.count[streams] >= self.window) & (self.nan_count[streams] == 0)
+        window_values = self.buffer[streams]
+        median = np.median(window_values, axis=1)
+        mad = MAD_SCALE * np.median(np.abs(window_values - median[:, None]), axis=1)
+        return self.flags(values, median, mad, ready)
+
+    def step_seasonal(self, streams, values, seasons):
+        if seasons is None:
+            raise ValueError("Для method='seasonal' нужны номера сезонов")
+
+        # пропуск не оценивается и не входит в базовую линию сезона
+        finite = ~np.isnan(values)
+        flags = np.full(len(values), np.nan)
+        streams, values, seasons = streams[finite], values[finite], seasons[finite]
+
+        count = self.season_count[streams, seasons]
+        mean = self.season_mean[streams, seasons]
+        m2 = self.season_m2[streams, seasons]
+
+        # оцениваем по базовой линии до текущего показания, затем добавляем его
+        ready = count >= self.min_season_count
+        std = np.sqrt(np.divide(m2, count - 1, out=np.zeros(len(count)), where=count > 1))
+        flags[finite] = self.flags(values, mean, std, ready)
+
+        count = count + 1
+        delta = values - mean
+        mean = mean + delta / count
+        self.season_count[streams, seasons] = count
+        self.season_mean[streams, seasons] = mean
+        self.season_m2[streams, seasons] = m2 + delta * (values - mean)
+
+        return flags
+
+    def flags(self, values, center, spread, ready):
+        anomaly = (values < center - self.n_sigmas * spread) | (values > center + self.n_sigmas * spread)
+        return np.where(ready & ~np.isnan(spread), anomaly, np.nan)
+
+
+# Флаги для всего датафрейма наблюдений одним проходом детектора; строки городов — в порядке времени.
+# Для method="rolling" результат совпадает со столбцом is_anomaly из city_statistics
+def streaming_anomalies(df, window_days=30, method="rolling", n_sigmas=2):
+    codes, cities = pd.factorize(df["city"])
+    seasons, season_names = pd.factorize(df["season"])
+    detector = StreamingAnomalyDetector(len(cities), window_days, n_sigmas, method, n_seasons=len(season_names))
+    return detector.score(codes, df["temperature"].to_numpy(dtype=np.float64), seasons)
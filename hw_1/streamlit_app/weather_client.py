@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import aiohttp
+
+from processing import http_error, parse_weather
+
+# Асинхронный клиент OpenWeatherMap для текущей погоды сразу по многим городам:
+# одна сессия с пулом соединений, ограничение числа одновременных запросов, таймауты, ретраи
+# и TTL-кэш успешных ответов по (API-ключ, город): ответ, полученный с одним ключом, не отдается
+# запросу с другим, поэтому неверный ключ по-прежнему дает ошибку.
+# Адрес API переопределяется (OPENWEATHER_API_URL или base_url), например на локальный stub-сервер
+API_URL = os.environ.get("OPENWEATHER_API_URL", "https://api.openweathermap.org/data/2.5/weather")
+CACHE_TTL_SECONDS = 600
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TTLCache:
+    """Ответы API по ключу с временем жизни ttl секунд"""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.items = {}
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self.items[key]
+            return None
+        return value
+
+    def set(self, key, value):
+        self.items[key] = (time.monotonic() + self.ttl, value)
+
+
+# Общий кэш процесса: переживает перезапуски скрипта Streamlit и новые экземпляры клиента
+weather_cache = TTLCache()
+
+
+class WeatherClient:
+    """Клиент текущей погоды, используется как async context manager:
+
+        async with WeatherClient(api_key) as client:
+            responses = await client.fetch_all(cities)
+    """
+
+    def __init__(self, api_key, base_url=API_URL, concurrency=10, timeout=10, retries=2,
+                 retry_delay=0.5, cache=weather_cache):
+        self.api_key = api_key
+        # в ключе кэша — хэш API-ключа, а не сам ключ
+        self.key_hash = hashlib.sha256(str(api_key).encode()).hexdigest()
+        self.base_url = base_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def fetch(self, city):
+        """Ответ в формате get_response: температура, сезон и иконка или {"error": ...}"""
+        cache_key = (self.base_url, self.key_hash, city)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        async with self.semaphore:
+            response = await self.request(city)
+
+        # ошибки не кэшируем, чтобы следующий запуск мог их исправить
+        if "error" not in response:
+            self.cache.set(cache_key, response)
+        return response
+
+    async def request(self, city):
+        params = {"q": city, "appid": self.api_key, "units": "metric"}
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.get(self.base_url, params=params) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.retries:
+                        await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                        continue
+
+                    try:
+                        response.raise_for_status()
+                    except aiohttp.ClientResponseError as e:
+                        return http_error(response.status, e)
+
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        return {"error": "Некорректный формат ответа от API"}
+
+                    # тело без ожидаемой структуры (пустой weather, не объект) — ошибка только этого города
+                    try:
+                        return parse_weather(data)
+                    except (KeyError, IndexError, TypeError, AttributeError, ValueError):
+                        return {"error": "Некорректный формат данных от API"}
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    return {"error": f"Ошибка: {e!r}"}
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    async def fetch_all(self, cities):
+        """Текущая погода по всем городам: город -> ответ"""
+        responses = await asyncio.gather(*(self.fetch(city) for city in cities))
+        return dict(zip(cities, responses))
+
+
+# Синхронная обертка для Streamlit: свой event loop на вызов, кэш общий
+def get_responses(cities, api_key, **client_options):
+    async def fetch():
+        async with WeatherClient(api_key, **client_options) as client:
+            return await client.fetch_all(list(cities))
+
+    return asyncio.run(fetch())
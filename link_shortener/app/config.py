@@ -11,4 +11,19 @@ DB_NAME = os.getenv("DB_NAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 SMTP_USER = os.getenv("SMTP_USER")
 
-SECRET = os.getenv("SECRET")
\ No newline at end of file
+SECRET = os.getenv("SECRET")
+
+# Архив истекших ссылок
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 30))
+
+# Фоновая очистка: аренда в Redis на цикл, шарды по short_code
+CLEANUP_INTERVAL_SECONDS = int(os.getenv("CLEANUP_INTERVAL_SECONDS", 600))
+CLEANUP_POLL_SECONDS = int(os.getenv("CLEANUP_POLL_SECONDS", 30))
+CLEANUP_SHARDS = int(os.getenv("CLEANUP_SHARDS", 1))
+
+# Очередь побочных эффектов запросов; TASK_QUEUE_STREAM включает хранение задач в Redis Stream
+TASK_QUEUE_CONCURRENCY = int(os.getenv("TASK_QUEUE_CONCURRENCY", 4))
+TASK_QUEUE_MAXSIZE = int(os.getenv("TASK_QUEUE_MAXSIZE", 10000))
+TASK_QUEUE_MAX_RETRIES = int(os.getenv("TASK_QUEUE_MAX_RETRIES", 3))
+TASK_QUEUE_STREAM = os.getenv("TASK_QUEUE_STREAM", "")
@@ -0,0 +1,212 @@
+import csv
+import fcntl
+import gzip
+import json
+import logging
+import mmap
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from io import StringIO
+from typing import List, Optional
+from uuid import UUID
+
+from app.config import ARCHIVE_DIR
+from app.links.models import ExpiredLink
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = "index"
+LOCK_FILE = "index.lock"
+
+# Архив истекших ссылок хранится в месячных партициях expired_links_YYYY-MM.csv.gz (по expires_at).
+# Каждая выгрузка дописывает в партицию по одному gzip-блоку на пользователя,
+# а index/<user_id>.json хранит смещения блоков пользователя по партициям и id удаленных ссылок —
+# при чтении разбирается только индекс нужного пользователя, через mmap распаковываются только его блоки.
+# Запись в архив (архиватор) и пометка удаления (реактивация в любой реплике) меняют индексы
+# под эксклюзивной блокировкой index.lock, поэтому изменения не теряются при одновременной записи.
+
+
+def partition_name(link: ExpiredLink) -> str:
+    """Возвращает имя месячной партиции для ссылки"""
+    return link.expires_at.strftime("%Y-%m")
+
+
+def partition_path(partition: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"expired_links_{partition}.csv.gz")
+
+
+def user_index_path(user_id: str) -> str:
+    return os.path.join(ARCHIVE_DIR, INDEX_DIR, f"{user_id}.json")
+
+
+@contextmanager
+def index_lock():
+    """Эксклюзивная блокировка индексов архива между процессами на время чтения-изменения-записи"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    with open(os.path.join(ARCHIVE_DIR, LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def load_user_index(user_id: str) -> dict:
+    """Читает индекс пользователя: партиция -> смещения его блоков и id удаленных ссылок"""
+    path = user_index_path(user_id)
+
+    if not os.path.exists(path):
+        return {"partitions": {}, "deleted": []}
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_user_index(user_id: str, index: dict):
+    """Атомарно перезаписывает индекс пользователя"""
+    path = user_index_path(user_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    os.replace(tmp_path, path)
+
+
+def _serialize(link: ExpiredLink) -> list:
+    return [
+        link.id,
+        str(link.user_id),
+        link.original_url,
+        link.short_code,
+        link.created_at.isoformat(),
+        link.expires_at.isoformat(),
+        link.last_click_at.isoformat() if link.last_click_at else "",
+        link.clicks,
+        int(link.is_soft_expire)
+    ]
+
+
+def _deserialize(row: list) -> ExpiredLink:
+    return ExpiredLink(
+        id=int(row[0]),
+        user_id=UUID(row[1]),
+        original_url=row[2],
+        short_code=row[3],
+        created_at=datetime.fromisoformat(row[4]),
+        expires_at=datetime.fromisoformat(row[5]),
+        last_click_at=datetime.fromisoformat(row[6]) if row[6] else None,
+        clicks=int(row[7]),
+        is_soft_expire=bool(int(row[8]))
+    )
+
+
+def write_links(links: List[ExpiredLink]) -> int:
+    """Дописывает истекшие ссылки в архив, группируя их по партициям и пользователям"""
+    partitions = {}
+
+    for link in links:
+        users = partitions.setdefault(partition_name(link), {})
+        users.setdefault(str(link.user_id), []).append(link)
+
+    with index_lock():
+        user_blocks = {}
+
+        for partition, users in partitions.items():
+            with open(partition_path(partition), "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+
+                for user_id, user_links in users.items():
+                    output = StringIO()
+                    writer = csv.writer(output)
+                    writer.writerows(_serialize(link) for link in user_links)
+                    block = gzip.compress(output.getvalue().encode("utf-8"))
+
+                    f.write(block)
+                    user_blocks.setdefault(user_id, []).append((partition, [offset, len(block)]))
+                    offset += len(block)
+
+                f.flush()
+                os.fsync(f.fileno())
+
+            logger.info(f"Archive: Wrote {sum(len(user_links) for user_links in users.values())} links to partition {partition}")
+
+        for user_id, blocks in user_blocks.items():
+            index = load_user_index(user_id)
+
+            for partition, block in blocks:
+                index["partitions"].setdefault(partition, []).append(block)
+
+            save_user_index(user_id, index)
+
+    return len(links)
+
+
+def _read_blocks(partition: str, blocks: list) -> List[ExpiredLink]:
+    links = []
+
+    with open(partition_path(partition), "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for offset, length in blocks:
+            data = gzip.decompress(mm[offset:offset + length]).decode("utf-8")
+            links.extend(_deserialize(row) for row in csv.reader(StringIO(data)))
+
+    return links
+
+
+def read_user_links(user_id: str) -> List[ExpiredLink]:
+    """Возвращает все архивные ссылки пользователя"""
+    index = load_user_index(user_id)
+    deleted = set(index["deleted"])
+    links = []
+
+    for partition, blocks in sorted(index["partitions"].items()):
+        links.extend(link for link in _read_blocks(partition, blocks) if link.id not in deleted)
+
+    logger.info(f"Archive: Found {len(links)} archived links for user {user_id}")
+    return links
+
+
+def find_user_link(user_id: str, link_id: int) -> Optional[ExpiredLink]:
+    """Ищет архивную ссылку пользователя по id"""
+    for link in read_user_links(user_id):
+        if link.id == link_id:
+            return link
+
+    return None
+
+
+def remove_link(link: ExpiredLink) -> bool:
+    """Помечает архивную ссылку удаленной (например, после реактивации).
+    Возвращает False, если ссылка уже была помечена — реактивировать ее повторно нельзя"""
+    user_id = str(link.user_id)
+
+    with index_lock():
+        index = load_user_index(user_id)
+
+        if link.id in index["deleted"]:
+            logger.warning(f"Archive: Link {link.id} is already marked as deleted")
+            return False
+
+        index["deleted"].append(link.id)
+        save_user_index(user_id, index)
+
+    logger.info(f"Archive: Link {link.id} marked as deleted for user {user_id}")
+    return True
+
+
+def restore_link(link: ExpiredLink):
+    """Снимает пометку удаления с архивной ссылки (если реактивацию не удалось сохранить в базе)"""
+    user_id = str(link.user_id)
+
+    with index_lock():
+        index = load_user_index(user_id)
+
+        if link.id in index["deleted"]:
+            index["deleted"].remove(link.id)
+            save_user_index(user_id, index)
+
+    logger.info(f"Archive: Link {link.id} restored for user {user_id}")
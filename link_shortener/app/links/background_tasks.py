@@ -1,26 +1,43 @@
 import asyncio
 import logging
-from datetime import datetime
-from sqlalchemy import delete, select, insert
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
+from app.config import (ARCHIVE_AFTER_DAYS, CLEANUP_INTERVAL_SECONDS,
+                        CLEANUP_POLL_SECONDS, CLEANUP_SHARDS)
 from app.database.database import async_session_maker
 
+from app.links import archive
+from app.links.lease import hold_lease
 from app.links.models import Link, ExpiredLink
-from app.links.service import delete_link_from_cache
+from app.links.service import delete_link_from_cache, delete_link_responses_from_cache
+from app.links.task_queue import task_queue
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s - %(levelname)s - %(message)s",
                     handlers=[logging.StreamHandler()])
 
 
-async def delete_expired_links(session: AsyncSession):
+LEASE_KEY = "cleanup:lease"
+
+
+async def delete_expired_links(session: AsyncSession,
+                               shard: int = 0,
+                               shards: int = 1):
     """Перемещает истекшие ссылки авторизованных пользователей в таблицу expired_links
-    и удаляет их из основной таблицы. Ссылки неавторизованных пользователей просто удаляет """
+    и удаляет их из основной таблицы. Ссылки неавторизованных пользователей просто удаляет.
+    При shards > 1 обрабатывает только ссылки своего шарда (по хешу short_code)"""
 
-    logging.info("Starting expired links cleanup")
+    logging.info(f"Starting expired links cleanup for shard {shard}/{shards}")
     now = datetime.utcnow()
     query = select(Link).where(Link.expires_at.is_not(None), Link.expires_at < now)
+
+    if shards > 1:
+        query = query.where(func.hashtext(Link.short_code).op("&")(0x7FFFFFFF) % shards == shard)
+
+    # строки, которые уже обрабатывает другой процесс, пропускаем
+    query = query.with_for_update(skip_locked=True)
     result = await session.execute(query)
     expired_links = result.scalars().all()
 
@@ -46,6 +63,7 @@ async def delete_expired_links(session: AsyncSession):
 
             await session.delete(link)
             await delete_link_from_cache(link.short_code)
+            await delete_link_responses_from_cache(link.user_id, link.short_code)
 
         await session.commit()
         logging.info(f"Successfully processed {len(expired_links)} expired links")
@@ -53,22 +71,82 @@ async def delete_expired_links(session: AsyncSession):
         logging.info("No expired links found")
 
 
+async def archive_expired_links(session: AsyncSession, batch_size: int = 1000):
+    """Выгружает истекшие ссылки старше ARCHIVE_AFTER_DAYS дней в архив на диске
+    и удаляет их из таблицы expired_links, чтобы размер таблицы оставался ограниченным"""
+
+    logging.info("Starting expired links archiving")
+    cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    archived_count = 0
+
+    while True:
+        query = select(ExpiredLink) \
+            .where(ExpiredLink.expires_at < cutoff) \
+            .order_by(ExpiredLink.id) \
+            .limit(batch_size)
+        result = await session.execute(query)
+        expired_links = result.scalars().all()
+
+        if not expired_links:
+            break
+
+        # сначала пишем на диск, потом удаляем из базы — при сбое запись не теряется
+        await asyncio.to_thread(archive.write_links, expired_links)
+        await session.execute(delete(ExpiredLink).where(ExpiredLink.id.in_([link.id for link in expired_links])))
+        await session.commit()
+        archived_count += len(expired_links)
+
+    if archived_count:
+        logging.info(f"Successfully archived {archived_count} expired links")
+    else:
+        logging.info("No expired links to archive")
+
+
+async def sweep_shard(shard: int, shards: int):
+    """Очищает шард, если этот процесс взял его аренду на текущий цикл"""
+    async with hold_lease(f"{LEASE_KEY}:shard:{shard}:{shards}", CLEANUP_INTERVAL_SECONDS) as acquired:
+        if not acquired:
+            return
+
+        async with async_session_maker() as session:
+            await delete_expired_links(session, shard, shards)
+
+
+async def archive_if_leader():
+    """Выгружает старые истекшие ссылки в архив, если этот процесс взял аренду архивации"""
+    async with hold_lease(f"{LEASE_KEY}:archive", CLEANUP_INTERVAL_SECONDS) as acquired:
+        if not acquired:
+            return
+
+        async with async_session_maker() as session:
+            await archive_expired_links(session)
+
+
 async def cleanup_expired_links():
-    """Запускает очистку истекших ссылок каждыe 10 минут"""
+    """Запускает очистку истекших ссылок раз в CLEANUP_INTERVAL_SECONDS (по умолчанию 10 минут).
+    Очистку запускают все web-реплики и worker, но каждый шард за цикл обрабатывает только
+    процесс, взявший его аренду в Redis. Если владелец аренды упал, ключ истекает
+    и шард подхватывает другой процесс при следующем опросе"""
     logging.info("Starting expired links cleanup task")
+
     while True:
-        async with async_session_maker() as session:
-            await delete_expired_links(session)
-        await asyncio.sleep(600)
+        try:
+            await asyncio.gather(*(sweep_shard(shard, CLEANUP_SHARDS) for shard in range(CLEANUP_SHARDS)))
+            await archive_if_leader()
+        except Exception as e:
+            logging.error(f"Expired links cleanup failed: {e}")
+        await asyncio.sleep(CLEANUP_POLL_SECONDS)
 
 
 @asynccontextmanager
 async def lifespan(app):
     """Запускает фоновые задачи при старте приложения"""
     logging.info("Starting background tasks")
+    await task_queue.start()
     cleanup_task = asyncio.create_task(cleanup_expired_links())
     yield
     logging.info("Stopping background tasks")
+    await task_queue.stop()
     cleanup_task.cancel()
     try:
         await cleanup_task
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from contextlib import asynccontextmanager
+
+from app.links.service import redis
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор процесса-владельца аренды: web-реплики и worker пишут в одни и те же ключи Redis
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Продлеваем и снимаем аренду только если ключ всё ещё принадлежит этому процессу
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+async def acquire_lease(key: str, ttl: int) -> bool:
+    """Пытается взять аренду на ttl секунд, True — если ключ был свободен"""
+    acquired = await redis.set(key, INSTANCE_ID, nx=True, px=ttl * 1000)
+    return bool(acquired)
+
+
+async def renew_lease(key: str, ttl: int) -> bool:
+    """Продлевает аренду, False — если аренда уже потеряна"""
+    renewed = await redis.eval(RENEW_SCRIPT, 1, key, INSTANCE_ID, ttl * 1000)
+    return bool(renewed)
+
+
+async def release_lease(key: str):
+    """Освобождает аренду, чтобы её мог сразу взять другой процесс"""
+    await redis.eval(RELEASE_SCRIPT, 1, key, INSTANCE_ID)
+
+
+async def _keep_alive(key: str, ttl: int):
+    while True:
+        await asyncio.sleep(ttl / 3)
+        if not await renew_lease(key, ttl):
+            logger.warning(f"Lease: Lost lease {key}")
+            return
+
+
+@asynccontextmanager
+async def hold_lease(key: str, ttl: int):
+    """Выполняет блок, только если удалось взять аренду; пока блок работает, аренда продлевается.
+    После успешного завершения ключ остается до истечения ttl — так другие процессы
+    не повторяют ту же работу в текущем цикле. При ошибке аренда снимается сразу."""
+    acquired = await acquire_lease(key, ttl)
+
+    if not acquired:
+        yield False
+        return
+
+    logger.info(f"Lease: Acquired {key} by {INSTANCE_ID}")
+    keep_alive_task = asyncio.create_task(_keep_alive(key, ttl))
+    try:
+        yield True
+    except BaseException:
+        await release_lease(key)
+        raise
+    finally:
+        keep_alive_task.cancel()
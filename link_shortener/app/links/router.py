@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi_users import FastAPIUsers
 from typing import List, Optional
@@ -62,18 +62,20 @@ async def update_link(
 async def get_stats(
         short_code: str,
         session: AsyncSession = Depends(get_async_session),
-        user: User = Depends(current_active_user)
+        user: User = Depends(current_active_user),
+        if_none_match: Optional[str] = Header(default=None)
 ):
     logger.info(f"Getting stats for link {short_code} by user {user.id}")
-    return await service.get_link_stats(short_code, session, user)
+    return await service.get_link_stats(short_code, session, user, if_none_match)
 
 @router.get("/my_links", response_model=UsersLinksResponse)
 async def get_my_links(
         session: AsyncSession = Depends(get_async_session),
-        user: User = Depends(current_active_user)
+        user: User = Depends(current_active_user),
+        if_none_match: Optional[str] = Header(default=None)
 ):
     logger.info(f"Getting all links for user {user.id}")
-    return await service.get_users_links(session, user)
+    return await service.get_users_links(session, user, if_none_match)
 
 @router.get("/my_links/download", response_class=StreamingResponse)
 async def download_my_links(
@@ -0,0 +1,19 @@
+import orjson
+from fastapi.responses import Response
+
+
+# Списки ссылок сериализуем сразу из строк выборки select(колонки) через orjson,
+# без создания ORM-объектов и валидации каждой строки pydantic-схемой
+def schema_columns(model, schema) -> list:
+    """Колонки модели в порядке полей схемы ответа"""
+    return [getattr(model, field) for field in schema.model_fields]
+
+
+def links_json(rows, schema) -> bytes:
+    """Собирает json вида {"links": [...]} из строк, упорядоченных по полям схемы"""
+    fields = list(schema.model_fields)
+    return orjson.dumps({"links": [dict(zip(fields, row)) for row in rows]})
+
+
+def json_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
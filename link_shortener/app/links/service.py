@@ -1,7 +1,10 @@
+import asyncio
 import csv
+import hashlib
 import logging
 import random
 import string
+from collections import namedtuple
 from datetime import datetime, timedelta
 from http.client import responses
 from io import StringIO
@@ -9,37 +12,43 @@ from typing import List, Optional
 from urllib.parse import unquote
 
 from fastapi import HTTPException
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from redis import asyncio as aioredis
 
 from app.auth.db import User
+from app.database.database import async_session_maker
+from app.links import archive
 from app.links.models import Link, ExpiredLink
+from app.links.serialization import json_response, links_json, schema_columns
 from app.links.schemas import (LinkCreateRequest, LinkCreateResponse,
                                LinkUpdateRequest, LinkUpdateResponse,
                                LinkStatsResponse,
-                               LinkSearch, LinkSearchResponse,
-                               UsersLinks, UsersLinksResponse,
-                               ExpiredLinks, ExpiredLinksResponse,
+                               LinkSearch, UsersLinks, ExpiredLinks,
                                LinkReactivateRequest, LinkReactivateResponse)
+from app.links.task_queue import task_queue
 
 logger = logging.getLogger(__name__)
 
 SHORT_CODE_LENGTH = 10
+RESPONSE_CACHE_TTL = 3600
 redis = aioredis.from_url("redis://redis", decode_responses=True)
 
 
 # Кеширование
+@task_queue.task
 async def save_link_in_cache(short_code: str,
                              original_url: str,
                              created_at: datetime,
+                             user_id: str | None = None,
                              expires_in: int = 3600):
-    """Сохраняем короткую ссылку в кэш"""
+    """Сохраняем короткую ссылку в кэш; user_id владельца нужен для проверки доступа к статистике из кэша"""
     logging.info(f"Cache: Saving link {short_code} with original_url={original_url}")
     link_data = {
         "original_url": original_url,
-        "created_at": created_at.isoformat()
+        "created_at": created_at.isoformat(),
+        "user_id": user_id or ""
     }
 
     await redis.hset(short_code, mapping=link_data)
@@ -47,6 +56,7 @@ async def save_link_in_cache(short_code: str,
     logging.info(f"Cache: Link {short_code} saved successfully")
 
 
+@task_queue.task
 async def save_stats_in_cache(short_code: str,
                               clicks: int,
                               last_click_at: datetime | None = None,
@@ -116,6 +126,69 @@ async def delete_link_from_cache(short_code: str):
     logging.info(f"Cache: Link {short_code} deleted successfully")
 
 
+# Кеширование готовых ответов /stats и /my_links: храним сериализованный json и его ETag
+def stats_response_key(user_id, short_code: str) -> str:
+    return f"response:stats:{user_id}:{short_code}"
+
+
+def users_links_response_key(user_id) -> str:
+    return f"response:my_links:{user_id}"
+
+
+async def save_response_in_cache(key: str,
+                                 body: bytes,
+                                 expires_in: int = RESPONSE_CACHE_TTL) -> dict:
+    """Сохраняет сериализованный json ответа в кэш вместе с ETag"""
+    cached_response = {
+        "body": body,
+        "etag": f'"{hashlib.md5(body).hexdigest()}"'
+    }
+
+    await redis.hset(key, mapping=cached_response)
+    await redis.expire(key, expires_in)
+    logging.info(f"Cache: Response {key} saved")
+    return cached_response
+
+
+async def get_response_from_cache(key: str) -> dict | None:
+    """Отдает сериализованный ответ и его ETag из кэша"""
+    cached_response = await redis.hgetall(key)
+
+    if cached_response:
+        logging.info(f"Cache: Response {key} found")
+        return cached_response
+
+    return None
+
+
+async def delete_link_responses_from_cache(user_id, short_code: str | None = None):
+    """Сбрасывает закэшированные ответы /my_links пользователя и /stats его ссылки"""
+    if user_id is None:
+        return
+
+    keys = [users_links_response_key(user_id)]
+    if short_code:
+        keys.append(stats_response_key(user_id, short_code))
+
+    await redis.delete(*keys)
+    logging.info(f"Cache: Responses {keys} deleted")
+
+
+def cached_json_response(cached_response: dict,
+                         if_none_match: str | None = None) -> Response:
+    """Возвращает закэшированный json, или 304, если у клиента актуальная версия"""
+    etag = cached_response["etag"]
+
+    if if_none_match:
+        client_etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in client_etags or etag in client_etags:
+            return Response(status_code=304, headers={"ETag": etag})
+
+    return Response(content=cached_response["body"],
+                    media_type="application/json",
+                    headers={"ETag": etag})
+
+
 # Обновление статистики в базе для функций из кэша
 async def update_stats_in_db(short_code: str,
                              clicks: int,
@@ -129,7 +202,8 @@ async def update_stats_in_db(short_code: str,
     result = await session.execute(query)
     link_data = result.scalar_one_or_none()
 
-    if link_data:
+    # задачи из очереди могут выполниться не по порядку — не откатываем счетчик назад
+    if link_data and clicks >= link_data.clicks:
         link_data.clicks = clicks
         link_data.last_click_at = last_click_at
 
@@ -142,6 +216,28 @@ async def update_stats_in_db(short_code: str,
 
         await session.commit()
 
+        # обновляем закэшированный ответ /stats, список ссылок пользователя пересоберется при запросе
+        if link_data.user_id:
+            stats = LinkStatsResponse.model_validate(link_data.__dict__)
+            await save_response_in_cache(stats_response_key(link_data.user_id, short_code),
+                                         stats.model_dump_json().encode("utf-8"))
+            await delete_link_responses_from_cache(link_data.user_id)
+
+
+@task_queue.task
+async def update_stats_in_db_task(short_code: str,
+                                  clicks: int,
+                                  last_click_at: datetime,
+                                  is_soft_expire: bool = False,
+                                  expires_at: datetime | None = None):
+    """Обновляет статистику в базе из очереди задач — в своей сессии, т.к. сессия запроса уже закрыта"""
+    async with async_session_maker() as session:
+        await update_stats_in_db(short_code, clicks, last_click_at, session, is_soft_expire, expires_at)
+
+
+# Строка архивной истекшей ссылки с теми же полями, что и выборка из expired_links
+ExpiredLinkRow = namedtuple("ExpiredLinkRow", list(ExpiredLinks.model_fields))
+
 
 # Основные функции сервиса
 async def get_unique_code(session: AsyncSession,
@@ -224,6 +320,7 @@ async def create_short_link(link_data: LinkCreateRequest,
     # сохраняем изменения в базу
     session.add(new_link)
     await session.commit()
+    await delete_link_responses_from_cache(new_link.user_id)
 
     return LinkCreateResponse(
         message="Ссылка успешно создана",
@@ -253,14 +350,16 @@ async def redirect(short_code: str,
         is_soft_expire = bool(int(cached_stats["is_soft_expire"]))
         logging.info(f"Cache: is_soft_expire={is_soft_expire}")
 
+        # счетчик в кэше обновляем сразу — из него читает следующий переход,
+        # а запись в базу откладываем в очередь задач
         if is_soft_expire:
             expires_at = datetime.utcnow() + timedelta(days=14)
             logging.info(f"Cache: Updating expires_at to {expires_at}")
             await save_stats_in_cache(short_code, clicks, last_click_at, is_soft_expire, expires_at)
-            await update_stats_in_db(short_code, clicks, last_click_at, session, is_soft_expire, expires_at)
+            await task_queue.enqueue(update_stats_in_db_task, short_code, clicks, last_click_at, is_soft_expire, expires_at)
         else:
             await save_stats_in_cache(short_code, clicks, last_click_at, is_soft_expire)
-            await update_stats_in_db(short_code, clicks, last_click_at, session, is_soft_expire)
+            await task_queue.enqueue(update_stats_in_db_task, short_code, clicks, last_click_at, is_soft_expire)
 
         return RedirectResponse(url=cached_link["original_url"])
 
@@ -286,9 +385,12 @@ async def redirect(short_code: str,
 
     # сохраняем изменения в базу
     await session.commit()
+    await delete_link_responses_from_cache(link_data.user_id, short_code)
 
-    # сохраняем в кэш
-    await save_link_in_cache(short_code, link_data.original_url, link_data.created_at)
+    # ссылку кэшируем после ответа, через очередь задач. Счетчик кликов пишем в кэш сразу, как и при
+    # переходе из кэша: из очереди записи могли бы выполниться не по порядку и оставить меньшее значение
+    await task_queue.enqueue(save_link_in_cache, short_code, link_data.original_url, link_data.created_at,
+                             str(link_data.user_id) if link_data.user_id else None)
     if link_data.is_soft_expire:
         await save_stats_in_cache(short_code, link_data.clicks, link_data.last_click_at, link_data.is_soft_expire, link_data.expires_at)
     else:
@@ -324,6 +426,7 @@ async def delete_link(short_code: str,
     await session.commit()
     # удаление из кеша
     await delete_link_from_cache(short_code)
+    await delete_link_responses_from_cache(link_data.user_id, short_code)
     logging.info(f"Link {short_code} deleted successfully")
 
 
@@ -365,6 +468,7 @@ async def update_short_code(update_data: LinkUpdateRequest,
 
     # удаление из кеша старого short_code
     await delete_link_from_cache(update_data.short_code)
+    await delete_link_responses_from_cache(link_data.user_id, update_data.short_code)
     logging.info(f"Short code updated successfully from {update_data.short_code} to {new_short_code}")
 
     return LinkUpdateResponse(
@@ -376,14 +480,31 @@ async def update_short_code(update_data: LinkUpdateRequest,
 
 async def get_link_stats(short_code: str,
                          session: AsyncSession,
-                         user: User | None = None
-                         ) -> LinkStatsResponse:
-    """Возвращает статистику по короткой ссылке"""
+                         user: User | None = None,
+                         if_none_match: str | None = None
+                         ) -> Response:
+    """Возвращает статистику по короткой ссылке из кэша ответов или собирает её заново"""
+    key = stats_response_key(user.id, short_code)
+    cached_response = await get_response_from_cache(key)
+
+    if not cached_response:
+        stats = await build_link_stats(short_code, session, user)
+        cached_response = await save_response_in_cache(key, stats.model_dump_json().encode("utf-8"))
+
+    return cached_json_response(cached_response, if_none_match)
+
+
+async def build_link_stats(short_code: str,
+                           session: AsyncSession,
+                           user: User | None = None
+                           ) -> LinkStatsResponse:
+    """Собирает статистику по короткой ссылке"""
 
     cached_stats = await get_stats_from_cache(short_code)
     cached_link = await get_link_from_cache(short_code)
 
-    if cached_stats and cached_link:
+    # из кэша отвечаем только владельцу; чужие ссылки и записи кэша без user_id проверяются по базе
+    if cached_stats and cached_link and user and cached_link.get("user_id") == str(user.id):
         if "last_click_at" in cached_stats:
             last_click_at = cached_stats["last_click_at"]
         else:
@@ -417,8 +538,10 @@ async def get_link_stats(short_code: str,
 
     logging.info(f"Stats: Getting stats for {short_code}: is_soft_expire={link_data.is_soft_expire}, expires_at={link_data.expires_at}")
 
-    # сохраняем в кэш
-    await save_link_in_cache(short_code, link_data.original_url, link_data.created_at)
+    # ссылку кэшируем после ответа, через очередь задач. Счетчик кликов пишем в кэш сразу, как и при
+    # переходе из кэша: из очереди записи могли бы выполниться не по порядку и оставить меньшее значение
+    await task_queue.enqueue(save_link_in_cache, short_code, link_data.original_url, link_data.created_at,
+                             str(link_data.user_id) if link_data.user_id else None)
     if link_data.is_soft_expire:
         await save_stats_in_cache(short_code, link_data.clicks, link_data.last_click_at, link_data.is_soft_expire, link_data.expires_at)
     else:
@@ -431,14 +554,15 @@ async def get_link_stats(short_code: str,
 async def link_search(original_url: str,
                       session: AsyncSession,
                       user: User | None = None
-                      ) -> LinkSearchResponse:
+                      ) -> Response:
     """Ищет ссылку по оригинальному URL"""
     logging.info(f"Searching for URL: {original_url} for user {user.id if user else 'anonymous'}")
 
     original_url_decoded = unquote(original_url)
-    query = select(Link).where((Link.original_url == original_url_decoded) & (Link.user_id == user.id))
+    query = select(*schema_columns(Link, LinkSearch)) \
+        .where((Link.original_url == original_url_decoded) & (Link.user_id == user.id))
     result = await session.execute(query)
-    link_data_list: List[Link] = result.scalars().all()
+    link_data_list = result.all()
 
     if not link_data_list:
         logging.error(f"Link not found for URL: {original_url_decoded}")
@@ -448,17 +572,15 @@ async def link_search(original_url: str,
         )
 
     logging.info(f"Found {len(link_data_list)} links for URL: {original_url_decoded}")
-    links = [LinkSearch.model_validate(link_data.__dict__) for link_data in link_data_list]
-
-    return LinkSearchResponse(links=links)
+    return json_response(links_json(link_data_list, LinkSearch))
 
 
 async def get_users_links(session: AsyncSession,
-                          user: User
-                          ) -> UsersLinksResponse:
-    """Возвращает все созданные авторизованным пользователем ссылки"""
-    logging.info(f"Getting all links for user {user.id}")
-
+                          user: User,
+                          if_none_match: str | None = None
+                          ) -> Response:
+    """Возвращает все созданные авторизованным пользователем ссылки из кэша ответов
+    или собирает список заново"""
     if user is None:
         logging.error("Unauthorized attempt to get user links")
         raise HTTPException(
@@ -466,9 +588,25 @@ async def get_users_links(session: AsyncSession,
             detail="Просмотр доступен только зарегистрированным и авторизованным пользователям."
         )
 
-    query = select(Link).where(Link.user_id == user.id)
+    key = users_links_response_key(user.id)
+    cached_response = await get_response_from_cache(key)
+
+    if not cached_response:
+        users_links = await build_users_links(session, user)
+        cached_response = await save_response_in_cache(key, users_links)
+
+    return cached_json_response(cached_response, if_none_match)
+
+
+async def build_users_links(session: AsyncSession,
+                            user: User
+                            ) -> bytes:
+    """Собирает json со всеми созданными авторизованным пользователем ссылками"""
+    logging.info(f"Getting all links for user {user.id}")
+
+    query = select(*schema_columns(Link, UsersLinks)).where(Link.user_id == user.id)
     result = await session.execute(query)
-    link_data_list: List[Link] = result.scalars().all()
+    link_data_list = result.all()
 
     if not link_data_list:
         logging.info(f"No links found for user {user.id}")
@@ -478,9 +616,7 @@ async def get_users_links(session: AsyncSession,
         )
 
     logging.info(f"Found {len(link_data_list)} links for user {user.id}")
-    links = [UsersLinks.model_validate(link_data.__dict__) for link_data in link_data_list]
-
-    return UsersLinksResponse(links=links)
+    return links_json(link_data_list, UsersLinks)
 
 
 async def download_users_links(session: AsyncSession,
@@ -519,14 +655,30 @@ async def download_users_links(session: AsyncSession,
                              headers={"Content-Disposition": "attachment; filename=links.csv"})
 
 
+async def get_all_expired_links(session: AsyncSession,
+                                user: User
+                                ) -> list:
+    """Собирает истекшие ссылки пользователя из таблицы expired_links и из архива на диске
+    в виде строк с полями схемы ExpiredLinks"""
+    query = select(*schema_columns(ExpiredLink, ExpiredLinks)).where(ExpiredLink.user_id == user.id)
+    result = await session.execute(query)
+    expired_links = result.all()
+
+    archived_links = await asyncio.to_thread(archive.read_user_links, str(user.id))
+    # при сбое между выгрузкой в архив и удалением из базы запись может оказаться в обоих местах
+    db_ids = {link_data.id for link_data in expired_links}
+    archived_rows = [ExpiredLinkRow(*(getattr(link_data, field) for field in ExpiredLinkRow._fields))
+                     for link_data in archived_links if link_data.id not in db_ids]
+
+    return archived_rows + list(expired_links)
+
+
 async def get_expired_links(session: AsyncSession,
                             user: User
-                            ) -> ExpiredLinksResponse:
+                            ) -> Response:
     """Получает все истекшие ссылки для текущего пользователя"""
 
-    query = select(ExpiredLink).where(ExpiredLink.user_id == user.id)
-    result = await session.execute(query)
-    expired_links: List[ExpiredLink] = result.scalars().all()
+    expired_links = await get_all_expired_links(session, user)
 
     if not expired_links:
         raise HTTPException(
@@ -534,9 +686,7 @@ async def get_expired_links(session: AsyncSession,
             detail="У вас нет истекших ссылок."
         )
 
-    links = [ExpiredLinks.model_validate(link_data.__dict__) for link_data in expired_links]
-
-    return ExpiredLinksResponse(links=links)
+    return json_response(links_json(expired_links, ExpiredLinks))
 
 
 async def download_expired_links(session: AsyncSession,
@@ -544,9 +694,7 @@ async def download_expired_links(session: AsyncSession,
                                  ):
     """Возвращает csv-файл с информацией об истекших ссылках пользователя для скачивания"""
 
-    query = select(ExpiredLink).where(ExpiredLink.user_id == user.id)
-    result = await session.execute(query)
-    expired_links: List[ExpiredLink] = result.scalars().all()
+    expired_links = await get_all_expired_links(session, user)
 
     if not expired_links:
         raise HTTPException(
@@ -585,6 +733,11 @@ async def reactivate_link_by_id(reactivate_data: LinkReactivateRequest,
     query = select(ExpiredLink).where(ExpiredLink.id == reactivate_data.id, ExpiredLink.user_id == user.id)
     result = await session.execute(query)
     expired_link = result.scalar_one_or_none()
+    is_archived = False
+
+    if not expired_link:
+        expired_link = await asyncio.to_thread(archive.find_user_link, str(user.id), reactivate_data.id)
+        is_archived = expired_link is not None
 
     if not expired_link:
         logging.error(f"Expired link {reactivate_data.id} not found")
@@ -636,9 +789,33 @@ async def reactivate_link_by_id(reactivate_data: LinkReactivateRequest,
         last_click_at=expired_link.last_click_at
     )
 
-    session.add(new_link)
-    await session.delete(expired_link)
-    await session.commit()
+    if is_archived:
+        # Сначала помечаем ссылку удаленной в архиве: из одновременных реактиваций пройдет только одна
+        if not await asyncio.to_thread(archive.remove_link, expired_link):
+            logging.error(f"Archived link {reactivate_data.id} is already reactivated")
+            raise HTTPException(
+                status_code=404,
+                detail="Истекшая ссылка не найдена, проверьте корректность id."
+            )
+        session.add(new_link)
+        try:
+            await session.commit()
+        except Exception:
+            # ссылка не сохранена в базе — возвращаем ее в архив, чтобы ее можно было реактивировать снова
+            await session.rollback()
+            await asyncio.to_thread(archive.restore_link, expired_link)
+            raise
+    else:
+        session.add(new_link)
+        await session.delete(expired_link)
+        await session.commit()
+
+        # при сбое выгрузки копия ссылки могла остаться и в архиве — помечаем ее удаленной,
+        # иначе после удаления из базы она снова появится в истекших и ее можно будет реактивировать второй раз
+        archived_copy = await asyncio.to_thread(archive.find_user_link, str(user.id), reactivate_data.id)
+        if archived_copy:
+            await asyncio.to_thread(archive.remove_link, archived_copy)
+    await delete_link_responses_from_cache(user.id)
     logging.info(f"Link {expired_link.short_code} reactivated successfully as {new_custom_alias}")
 
     return LinkReactivateResponse(
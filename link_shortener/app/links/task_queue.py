@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
+
+from redis import asyncio as aioredis
+from redis.exceptions import ResponseError
+
+from app.config import (TASK_QUEUE_CONCURRENCY, TASK_QUEUE_MAXSIZE,
+                        TASK_QUEUE_MAX_RETRIES, TASK_QUEUE_STREAM)
+
+logger = logging.getLogger(__name__)
+
+STREAM_GROUP = "task_queue"
+# Сообщения, которые другой консьюмер не подтвердил дольше этого времени, забираем себе
+STREAM_CLAIM_IDLE_MS = 60_000
+# Пауза stream-воркера после ошибки Redis растет экспоненциально, но не больше этого значения
+STREAM_MAX_BACKOFF_SECONDS = 30
+
+
+# Аргументы задач сериализуются в json, datetime передаем как iso-строку с маркером
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Unsupported task argument type: {type(value)}")
+
+
+def _decode(value: dict):
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    return value
+
+
+class TaskQueue:
+    """Очередь некритичных побочных эффектов запроса (запись в кэш, обновление статистики).
+    Задачи выполняются пулом из concurrency воркеров после того, как запрос поставил их в очередь.
+    В памяти очередь ограничена maxsize: при переполнении enqueue ждет свободного места.
+    Если задан stream, задачи пишутся в Redis Stream и переживают перезапуск процесса."""
+
+    def __init__(self,
+                 concurrency: int = 4,
+                 maxsize: int = 10000,
+                 max_retries: int = 3,
+                 retry_delay: float = 0.5,
+                 stream: str | None = None):
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.stream = stream
+        self.handlers: Dict[str, Callable[..., Awaitable]] = {}
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.workers: List[asyncio.Task] = []
+        self.redis = aioredis.from_url("redis://redis", decode_responses=True) if stream else None
+        self.metrics = {
+            "enqueued": 0,
+            "processed": 0,
+            "retried": 0,
+            "failed": 0,
+            "last_lag_seconds": 0.0,
+            "max_lag_seconds": 0.0
+        }
+
+    def task(self, func: Callable[..., Awaitable]):
+        """Регистрирует корутину как задачу очереди; функцию по-прежнему можно вызывать напрямую"""
+        self.handlers[func.__name__] = func
+        return func
+
+    async def enqueue(self, func: Callable[..., Awaitable], *args):
+        """Ставит вызов func(*args) в очередь"""
+        name = func.__name__
+        if name not in self.handlers:
+            raise ValueError(f"Task {name} is not registered")
+
+        # воркеры не запущены (например, в процессе фонового worker'а) — выполняем сразу
+        if not self.workers:
+            await self.handlers[name](*args)
+            return
+
+        if self.stream:
+            await self.redis.xadd(self.stream, {
+                "name": name,
+                "args": json.dumps(args, default=_encode),
+                "enqueued_at": time.time()
+            })
+        else:
+            await self.queue.put((name, args, time.time()))
+
+        self.metrics["enqueued"] += 1
+
+    async def _run(self, name: str, args: tuple, enqueued_at: float):
+        lag = time.time() - enqueued_at
+        self.metrics["last_lag_seconds"] = lag
+        self.metrics["max_lag_seconds"] = max(self.metrics["max_lag_seconds"], lag)
+
+        if name not in self.handlers:
+            self.metrics["failed"] += 1
+            logger.error(f"Task queue: Unknown task {name}, dropped")
+            return
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.handlers[name](*args)
+                self.metrics["processed"] += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.metrics["failed"] += 1
+                    logger.error(f"Task queue: Task {name} failed after {attempt + 1} attempts: {e}")
+                    return
+
+                self.metrics["retried"] += 1
+                logger.warning(f"Task queue: Task {name} failed (attempt {attempt + 1}), retrying: {e}")
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    async def _memory_worker(self):
+        while True:
+            name, args, enqueued_at = await self.queue.get()
+            try:
+                await self._run(name, args, enqueued_at)
+            finally:
+                self.queue.task_done()
+
+    async def _run_message(self, message_id: str, fields: dict):
+        try:
+            name = fields["name"]
+            args = json.loads(fields["args"], object_hook=_decode)
+            enqueued_at = float(fields["enqueued_at"])
+        except (KeyError, TypeError, ValueError) as e:
+            self.metrics["failed"] += 1
+            logger.error(f"Task queue: Malformed message {message_id} dropped: {e}")
+        else:
+            await self._run(name, tuple(args), enqueued_at)
+        # задача подтверждается и после исчерпания ретраев, чтобы не зациклиться на ней
+        await self.redis.xack(self.stream, STREAM_GROUP, message_id)
+        await self.redis.xdel(self.stream, message_id)
+
+    async def _stream_worker(self, consumer: str):
+        claimed = False
+        failures = 0
+
+        # ошибка Redis не останавливает воркер: логируем, ждем и продолжаем
+        while True:
+            try:
+                if not claimed:
+                    # сначала забираем задачи, которые упавшие процессы не успели подтвердить
+                    _, messages, *_ = await self.redis.xautoclaim(self.stream, STREAM_GROUP, consumer,
+                                                                  min_idle_time=STREAM_CLAIM_IDLE_MS,
+                                                                  start_id="0-0")
+                    for message_id, fields in messages:
+                        await self._run_message(message_id, fields)
+                    claimed = True
+
+                response = await self.redis.xreadgroup(STREAM_GROUP, consumer, {self.stream: ">"},
+                                                       count=10, block=5000)
+                for _, messages in response or []:
+                    for message_id, fields in messages:
+                        await self._run_message(message_id, fields)
+                failures = 0
+            except Exception as e:
+                # после восстановления снова забираем неподтвержденные задачи (в том числе свои)
+                claimed = False
+                failures += 1
+                delay = min(self.retry_delay * 2 ** failures, STREAM_MAX_BACKOFF_SECONDS)
+                logger.error(f"Task queue: Stream worker {consumer} failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    async def start(self):
+        """Запускает воркеры очереди"""
+        if self.stream:
+            try:
+                await self.redis.xgroup_create(self.stream, STREAM_GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+            consumer_prefix = f"{id(self)}-{time.time()}"
+            self.workers = [asyncio.create_task(self._stream_worker(f"{consumer_prefix}-{i}"))
+                            for i in range(self.concurrency)]
+        else:
+            self.workers = [asyncio.create_task(self._memory_worker())
+                            for _ in range(self.concurrency)]
+
+        logger.info(f"Task queue: Started {self.concurrency} workers (stream={self.stream})")
+
+    async def stop(self, timeout: float = 10):
+        """Дожидается выполнения поставленных задач (не дольше timeout) и останавливает воркеры"""
+        if not self.stream:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Task queue: {self.queue.qsize()} tasks dropped on shutdown")
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        logger.info("Task queue: Stopped")
+
+    async def get_metrics(self) -> dict:
+        """Глубина очереди, задержка выполнения и счетчики задач"""
+        if self.stream:
+            groups = await self.redis.xinfo_groups(self.stream)
+            group = next(group for group in groups if group["name"] == STREAM_GROUP)
+            # lag — еще не выданные воркерам задачи, pending — выданные, но не подтвержденные
+            depth = (group.get("lag") or 0) + group["pending"]
+        else:
+            depth = self.queue.qsize()
+
+        return {"depth": depth, "workers": len(self.workers), **self.metrics}
+
+
+task_queue = TaskQueue(concurrency=TASK_QUEUE_CONCURRENCY,
+                       maxsize=TASK_QUEUE_MAXSIZE,
+                       max_retries=TASK_QUEUE_MAX_RETRIES,
+                       stream=TASK_QUEUE_STREAM or None)
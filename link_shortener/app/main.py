@@ -1,17 +1,19 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 import uvicorn
 
 from app.links.router import router as links_router
 from app.auth.users import fastapi_users, auth_backend
 from app.auth.schemas import UserRead, UserCreate, UserUpdate
 from app.links.background_tasks import lifespan
+from app.links.task_queue import task_queue
 from app.logger import get_logger
 
 logger = get_logger("app")
 
 try:
     logger.info("Initializing FastAPI application")
-    app = FastAPI(title="Link Shortener", lifespan=lifespan)
+    app = FastAPI(title="Link Shortener", lifespan=lifespan, default_response_class=ORJSONResponse)
 
     logger.info("Including auth routers")
     app.include_router(
@@ -23,6 +25,11 @@ try:
 
     logger.info("Including links router")
     app.include_router(links_router)
+
+    @app.get("/metrics/task_queue", tags=["metrics"])
+    async def task_queue_metrics():
+        return await task_queue.get_metrics()
+
     logger.info("Application initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize application: {e}")
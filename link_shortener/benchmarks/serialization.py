@@ -0,0 +1,79 @@
+"""Бенчмарк сериализации списка ссылок пользователя (GET /links/my_links).
+
+Сравнивает прежний путь (model_validate(link.__dict__) для каждой строки + json-энкодер FastAPI)
+с текущим (строки select(колонки) -> orjson). Запуск из папки link_shortener:
+
+    python -m benchmarks.serialization --rows 100000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from fastapi.encoders import jsonable_encoder
+
+from app.links.schemas import UsersLinks, UsersLinksResponse
+from app.links.serialization import links_json
+
+
+def make_rows(count: int) -> list:
+    now = datetime.utcnow()
+    fields = list(UsersLinks.model_fields)
+    rows = []
+
+    for i in range(count):
+        values = {
+            "short_code": f"CODE{i:06d}",
+            "original_url": f"https://example.com/page/{i}",
+            "created_at": now - timedelta(minutes=i),
+            "expires_at": now + timedelta(days=14),
+            "clicks": i % 1000,
+            "last_click_at": now if i % 2 else None
+        }
+        rows.append(tuple(values[field] for field in fields))
+
+    return rows
+
+
+def old_path(rows: list) -> bytes:
+    # объекты с __dict__ вместо ORM-моделей: гидратация SQLAlchemy здесь не учитывается,
+    # поэтому реальный прежний путь еще медленнее
+    fields = list(UsersLinks.model_fields)
+    objects = [SimpleNamespace(**dict(zip(fields, row))) for row in rows]
+    links = [UsersLinks.model_validate(link_data.__dict__) for link_data in objects]
+    response = UsersLinksResponse(links=links)
+    return json.dumps(jsonable_encoder(response)).encode("utf-8")
+
+
+def new_path(rows: list) -> bytes:
+    return links_json(rows, UsersLinks)
+
+
+def measure(func, rows: list, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(rows)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сериализации списка ссылок")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    old_time = measure(old_path, rows, args.repeat)
+    new_time = measure(new_path, rows, args.repeat)
+
+    print(f"rows: {args.rows}, response size: {len(new_path(rows)) / 2 ** 20:.1f} MB")
+    print(f"model_validate + jsonable_encoder: {old_time:.3f} s")
+    print(f"row tuples + orjson:               {new_time:.3f} s")
+    print(f"speedup: x{old_time / new_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()